@@ -0,0 +1,71 @@
+"""Cold-start benchmark for plugin loading.
+
+Imports each plugin in a fresh interpreter, as a new container would, and
+reports how long the import took. "shared" is the plugin helpers every
+plugin imports (plugins.utils and what it pulls in); each plugin's time
+includes them, as it would on a cold start. Run from src/:
+
+    python bench_startup.py
+    python bench_startup.py --repeat 10 --json
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+from plugins.manifest import PLUGINS
+
+CHILD = """
+import json, sys, time
+start = time.perf_counter()
+if sys.argv[1] == "shared":
+    import plugins.utils
+else:
+    from plugins.manifest import load_plugin_class
+    load_plugin_class(sys.argv[1])()
+print(json.dumps(time.perf_counter() - start))
+"""
+
+
+def time_import(name):
+    """Seconds a fresh interpreter takes to import a plugin, or "shared"."""
+    output = subprocess.run(
+        [sys.executable, "-c", CHILD, name],
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="imports per plugin")
+    parser.add_argument("--json", action="store_true", help="print results as json")
+    args = parser.parse_args()
+
+    results = {}
+    for name in ["shared", *PLUGINS]:
+        try:
+            times = [time_import(name) for _ in range(args.repeat)]
+        except subprocess.CalledProcessError as e:
+            print(f"{name} failed to import:\n{e.stderr}", file=sys.stderr)
+            continue
+        results[name] = {
+            "min": min(times),
+            "median": statistics.median(times),
+            "max": max(times),
+        }
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'plugin':<16}{'min':>10}{'median':>10}{'max':>10}")
+    for name, result in results.items():
+        print(f"{name:<16}" + "".join(f"{result[key]:>9.3f}s" for key in ["min", "median", "max"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+import threading
+import time
+from contextlib import contextmanager
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class CrawlBudget:
+    """Limits on the time, bytes and LLM tokens a single crawl may use.
+
+    The scraper stops starting pages once any limit is reached, and while a
+    budget is in use (see use_budget) downloads and summaries check it too,
+    so pages already in flight wind down quickly. Every limit is optional.
+
+    Args:
+        deadline: Seconds the crawl may run for.
+        max_bytes: Bytes the crawl may download or render.
+        max_tokens: LLM tokens the crawl may send, counting each prompt plus
+            its longest possible completion.
+    """
+
+    def __init__(self, deadline=None, max_bytes=None, max_tokens=None):
+        self.deadline = deadline
+        self.max_bytes = max_bytes
+        self.max_tokens = max_tokens
+        self.started_at = time.monotonic()
+        self.bytes = 0
+        self.tokens = 0
+        # the first limit that was hit, if any
+        self.exhausted_by = None
+        self.lock = threading.Lock()
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def remaining_time(self):
+        """Seconds left before the deadline, or None without one."""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - self.elapsed())
+
+    def exhaust(self, limit):
+        with self.lock:
+            self.exhausted_by = self.exhausted_by or limit
+
+    def exhausted(self):
+        """The name of the limit that ran out ("deadline", "bytes" or "tokens"), or None."""
+        if self.exhausted_by is None and self.remaining_time() == 0:
+            self.exhaust("deadline")
+        return self.exhausted_by
+
+    def check(self):
+        """Raise BudgetExceeded if any limit has run out."""
+        limit = self.exhausted()
+        if limit is not None:
+            raise BudgetExceeded(f"crawl {limit} budget exhausted")
+
+    def timeout(self, timeout):
+        """A timeout for one request, cut short so it ends by the deadline."""
+        remaining = self.remaining_time()
+        if remaining is None:
+            return timeout
+        return remaining if timeout is None else min(timeout, remaining)
+
+    def charge_bytes(self, amount):
+        with self.lock:
+            self.bytes += amount
+            if self.max_bytes is not None and self.bytes >= self.max_bytes:
+                self.exhausted_by = self.exhausted_by or "bytes"
+
+    def try_charge_tokens(self, amount) -> bool:
+        """Charge amount tokens if they fit in the budget, otherwise exhaust it."""
+        with self.lock:
+            if self.max_tokens is not None and self.tokens + amount > self.max_tokens:
+                self.exhausted_by = self.exhausted_by or "tokens"
+                return False
+            self.tokens += amount
+            return True
+
+    def record(self) -> dict:
+        """What the crawl used, and which limit stopped it if one did."""
+        return {
+            "exhausted": self.exhausted(),
+            "elapsed": round(self.elapsed(), 3),
+            "bytes": self.bytes,
+            "tokens": self.tokens,
+            "limits": {"deadline": self.deadline, "bytes": self.max_bytes, "tokens": self.max_tokens},
+        }
+
+
+# the budget of the crawl each thread is currently working for
+_current = threading.local()
+
+
+def current_budget():
+    """The budget in use on this thread, or None."""
+    return getattr(_current, "budget", None)
+
+
+@contextmanager
+def use_budget(budget):
+    """Charge downloads and summaries made on this thread to budget."""
+    previous = current_budget()
+    _current.budget = budget
+    try:
+        yield budget
+    finally:
+        _current.budget = previous
@@ -0,0 +1,116 @@
+import os
+import sqlite3
+import time
+
+from .frontier import Frontier
+from .urls import url_key
+
+
+class CheckpointFrontier(Frontier):
+    """Frontier that checkpoints itself to a SQLite file so a crawl can resume.
+
+    Every url the crawl has seen is stored with its state:
+
+        queued     waiting to be crawled
+        in_flight  popped, but its page hasn't finished
+        done       crawled, and counted against max_urls
+        dropped    popped but skipped, e.g. disallowed by robots.txt
+
+    Changes are kept in memory and written in one transaction at most every
+    `checkpoint_interval` seconds, and when the frontier is closed. Opening a
+    frontier on an existing file resumes it: queued and in-flight urls are
+    queued again, in-flight ones first, and the seeds are ignored. After a
+    crash only the pages in flight, plus those changed since the last
+    checkpoint, are crawled again.
+
+    Only one crawl may use a file at a time.
+    """
+
+    def __init__(self, path, seeds=(), visited=None, checkpoint_interval=5.0):
+        super().__init__(visited=visited)
+        self.path = path
+        self.checkpoint_interval = checkpoint_interval
+        # key -> (url, state, seq) changed since the last checkpoint
+        self.changes = {}
+        self.seq = 0
+        self.last_checkpoint = time.monotonic()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS urls (
+                key TEXT PRIMARY KEY,
+                url TEXT NOT NULL,
+                state TEXT NOT NULL,
+                seq INTEGER NOT NULL
+            )"""
+        )
+        self.db.commit()
+
+        self.resumed = self.load()
+        if not self.resumed:
+            for url in seeds:
+                self.add(url)
+            self.checkpoint()
+
+    def load(self) -> bool:
+        """Restore the frontier from the file. Returns whether there was anything to restore."""
+        rows = self.db.execute("SELECT key, url, state, seq FROM urls ORDER BY seq").fetchall()
+        in_flight = []
+        for key, url, state, seq in rows:
+            self.visited.add(key)
+            self.seq = max(self.seq, seq + 1)
+            if state == "queued":
+                self.push(self.next_key, url)
+                self.next_key += 1
+            elif state == "in_flight":
+                in_flight.append(url)
+            elif state == "done":
+                self.done += 1
+        for url in reversed(in_flight):
+            self.requeue(url)
+        if rows:
+            print(f"resumed crawl from {self.path}: {self.done} done, {len(self)} queued")
+        return bool(rows)
+
+    def record(self, url, state):
+        self.changes[url_key(url)] = (url, state, self.seq)
+        self.seq += 1
+        if time.monotonic() - self.last_checkpoint >= self.checkpoint_interval:
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Write every change since the last checkpoint to the file."""
+        if self.changes:
+            with self.db:
+                self.db.executemany(
+                    "INSERT OR REPLACE INTO urls (key, url, state, seq) VALUES (?, ?, ?, ?)",
+                    [(key, url, state, seq) for key, (url, state, seq) in self.changes.items()],
+                )
+            self.changes = {}
+        self.last_checkpoint = time.monotonic()
+
+    def add(self, url) -> bool:
+        if not super().add(url):
+            return False
+        self.record(url, "queued")
+        return True
+
+    def pop(self):
+        url = super().pop()
+        self.record(url, "in_flight")
+        return url
+
+    def pop_first(self, predicate):
+        url = super().pop_first(predicate)
+        if url is not None:
+            self.record(url, "in_flight")
+        return url
+
+    def mark_done(self, url, counted=True):
+        super().mark_done(url, counted)
+        self.record(url, "done" if counted else "dropped")
+
+    def close(self):
+        self.checkpoint()
+        self.db.close()
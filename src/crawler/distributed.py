@@ -0,0 +1,232 @@
+import hashlib
+import threading
+import time
+from urllib.parse import urlsplit
+
+from .frontier import Frontier
+from .registry import normalize_hostname
+
+
+def shard_for(url, num_shards) -> int:
+    """The shard that owns a url: a stable hash of its hostname.
+
+    Every url of a host belongs to the same shard, so per-host politeness
+    only has to hold within one worker.
+    """
+    hostname = normalize_hostname(urlsplit(url).hostname or "")
+    digest = hashlib.blake2b(hostname.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % num_shards
+
+
+class ShardFrontier(Frontier):
+    """One worker's part of a crawl shared by `num_shards` workers.
+
+    Urls are partitioned between workers by shard_for. A worker only queues
+    and deduplicates the urls of its own shard; links to other shards are
+    batched and posted to their owner through a shared dict-like store, on
+    Modal a `modal.Dict`. Since each url has a single owner, every page is
+    crawled once per run without any locking between workers. As in
+    JobStore, each key is only ever written by one worker:
+
+        {run_id}/mail/{sender}/{receiver}/{n}   n-th batch of urls from sender to receiver
+        {run_id}/shards/{shard}                 a worker's status
+        {run_id}/heartbeats/{shard}             when a worker was last alive
+
+    `done` counts the pages crawled by all workers. Each worker publishes
+    its own count and re-reads the others' after every page, so max_urls is
+    shared by the whole run and overshot by at most a page or so per worker.
+    While running, a worker writes a heartbeat from a background thread
+    every `heartbeat_interval` seconds. A worker with no heartbeat for
+    `dead_after` seconds counts as dead, as does one that hasn't started
+    within `start_grace` seconds, which allows for slow container starts,
+    so the others don't wait on it forever. delete_run removes a run's keys
+    once it is over.
+    """
+
+    def __init__(
+        self,
+        store,
+        run_id,
+        shard,
+        num_shards,
+        visited=None,
+        batch_size=50,
+        flush_interval=2.0,
+        poll_interval=1.0,
+        heartbeat_interval=5.0,
+        dead_after=60.0,
+        start_grace=600.0,
+    ):
+        super().__init__(visited=visited)
+        self.store = store
+        self.run_id = run_id
+        self.shard = shard
+        self.num_shards = num_shards
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        # how often an idle shard checks for new links
+        self.poll_interval = poll_interval
+        self.own_done = 0
+        self.outbox = {receiver: [] for receiver in range(num_shards)}
+        self.sent = {receiver: 0 for receiver in range(num_shards)}
+        self.received = {sender: 0 for sender in range(num_shards)}
+        self.last_flush = time.monotonic()
+        self.idle = False
+        self.last_snapshot = None
+        self.heartbeat_interval = heartbeat_interval
+        self.dead_after = dead_after
+        self.start_grace = start_grace
+        self.started_at = time.monotonic()
+        self.stopped = threading.Event()
+        self.heartbeat_thread = None
+
+    def start_heartbeat(self):
+        self.store[f"{self.run_id}/heartbeats/{self.shard}"] = time.time()
+        self.heartbeat_thread = threading.Thread(target=self.beat, daemon=True)
+        self.heartbeat_thread.start()
+
+    def beat(self):
+        while not self.stopped.wait(self.heartbeat_interval):
+            self.store[f"{self.run_id}/heartbeats/{self.shard}"] = time.time()
+
+    def close(self):
+        self.stopped.set()
+        if self.heartbeat_thread is not None:
+            self.heartbeat_thread.join()
+            self.heartbeat_thread = None
+
+    def dead_shards(self) -> set:
+        """Shards whose heartbeat has gone stale, or that haven't started within start_grace."""
+        dead = set()
+        for shard in range(self.num_shards):
+            if shard == self.shard:
+                continue
+            key = f"{self.run_id}/heartbeats/{shard}"
+            if key in self.store:
+                if time.time() - self.store[key] > self.dead_after:
+                    dead.add(shard)
+            elif time.monotonic() - self.started_at > self.start_grace:
+                dead.add(shard)
+        return dead
+
+    def owns(self, url) -> bool:
+        return shard_for(url, self.num_shards) == self.shard
+
+    def add(self, url) -> bool:
+        """Queue a url of this shard, or post it to the shard that owns it."""
+        receiver = shard_for(url, self.num_shards)
+        if receiver == self.shard:
+            return super().add(url)
+        self.outbox[receiver].append(url)
+        if len(self.outbox[receiver]) >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+        return True
+
+    def mark_done(self, url, counted=True):
+        super().mark_done(url, counted)
+        if counted:
+            self.own_done += 1
+            self.publish()
+            self.count_done()
+
+    def flush(self):
+        """Post every buffered link to its shard."""
+        for receiver, urls in self.outbox.items():
+            if urls:
+                self.store[f"{self.run_id}/mail/{self.shard}/{receiver}/{self.sent[receiver]}"] = urls
+                self.sent[receiver] += 1
+                self.outbox[receiver] = []
+        self.last_flush = time.monotonic()
+        # keep the other shards' view of this one's page count fresh
+        self.publish()
+
+    def receive(self) -> int:
+        """Queue every url posted to this shard so far. Returns how many batches arrived."""
+        batches = 0
+        for sender in range(self.num_shards):
+            while True:
+                key = f"{self.run_id}/mail/{sender}/{self.shard}/{self.received[sender]}"
+                if key not in self.store:
+                    break
+                for url in self.store.pop(key):
+                    super().add(url)
+                self.received[sender] += 1
+                batches += 1
+        return batches
+
+    def publish(self):
+        self.store[f"{self.run_id}/shards/{self.shard}"] = {
+            "idle": self.idle,
+            "done": self.own_done,
+            "sent": dict(self.sent),
+            "received": dict(self.received),
+        }
+
+    def statuses(self) -> list:
+        """Every worker's last published status, or None for those that haven't published yet."""
+        statuses = []
+        for shard in range(self.num_shards):
+            key = f"{self.run_id}/shards/{shard}"
+            statuses.append(self.store[key] if key in self.store else None)
+        return statuses
+
+    def sync(self):
+        """Exchange links with the other shards and refresh the run's page count."""
+        self.flush()
+        arrived = self.receive()
+        self.count_done()
+        return arrived
+
+    def count_done(self):
+        """Refresh done from the page counts the other shards have published."""
+        statuses = self.statuses()
+        others_done = sum(status["done"] for shard, status in enumerate(statuses) if status and shard != self.shard)
+        self.done = self.own_done + others_done
+
+    def set_idle(self, idle):
+        if idle != self.idle:
+            self.idle = idle
+            self.last_snapshot = None
+        self.publish()
+
+    def finished(self) -> bool:
+        """Whether the whole crawl is over: every live shard is idle and no links are in flight between them.
+
+        Statuses are read one at a time rather than atomically, so the crawl
+        only counts as finished once two snapshots in a row agree. Dead
+        shards count as finished, and links posted to them are lost.
+        """
+        dead = self.dead_shards()
+        statuses = self.statuses()
+        live = [shard for shard in range(self.num_shards) if shard not in dead]
+        if not all(statuses[shard] and statuses[shard]["idle"] for shard in live):
+            self.last_snapshot = None
+            return False
+        in_transit = any(
+            statuses[sender]["sent"][receiver] != statuses[receiver]["received"][sender]
+            for sender in live
+            for receiver in live
+        )
+        if in_transit:
+            self.last_snapshot = None
+            return False
+        finished = statuses == self.last_snapshot
+        self.last_snapshot = statuses
+        return finished
+
+
+def delete_run(store, run_id, num_shards):
+    """Remove the keys of a finished run: statuses, heartbeats and undelivered mail."""
+    keys = [f"{run_id}/shards/{shard}" for shard in range(num_shards)]
+    statuses = [store[key] if key in store else None for key in keys]
+    keys += [f"{run_id}/heartbeats/{shard}" for shard in range(num_shards)]
+    # mail is popped as it is received, so only mail to dead shards is left
+    for sender, status in enumerate(statuses):
+        if status is None:
+            continue
+        for receiver, sent in status["sent"].items():
+            received = statuses[receiver]["received"][sender] if statuses[receiver] else 0
+            keys += [f"{run_id}/mail/{sender}/{receiver}/{n}" for n in range(received, sent)]
+    for key in keys:
+        if key in store:
+            store.pop(key)
@@ -0,0 +1,166 @@
+import heapq
+from urllib.parse import urlsplit
+
+from .urls import url_key
+from .visited import ExactVisitedSet
+
+
+def host_of(url) -> str:
+    try:
+        return (urlsplit(url).hostname or "").lower()
+    except ValueError:
+        return ""
+
+
+class Frontier:
+    """FIFO crawl frontier.
+
+    Pending urls are queued per host, and a heap holds each host's oldest
+    url, so popping the next url costs O(log hosts). pop_first, which the
+    concurrent crawl uses to skip hosts that are being rate limited, tests
+    one url per host rather than every queued url, and never takes a host's
+    urls out of order. Every url that has ever been queued is remembered in
+    a visited set so duplicate checks are O(1). Urls are deduplicated by
+    their url_key, so different spellings of the same page are only queued
+    once.
+    """
+
+    def __init__(self, seeds=(), visited=None):
+        # host -> heap of (key, url); keys order urls, here by when they were queued
+        self.hosts = {}
+        # (key, host) of each host's first url; entries for urls already
+        # popped are left behind and skipped
+        self.heads = []
+        self.size = 0
+        self.next_key = 0
+        # keys of urls queued ahead of all others count down from here
+        self.first_key = 0
+        # an ExactVisitedSet, or a BloomVisitedSet for very large crawls
+        self.visited = visited if visited is not None else ExactVisitedSet()
+        # pages crawled, counted against max_urls
+        self.done = 0
+        for url in seeds:
+            self.add(url)
+
+    def add(self, url) -> bool:
+        """Queue a url unless it has already been discovered.
+
+        Returns:
+            True if the url was queued, False if it was a duplicate.
+        """
+        if not self.visited.add(url_key(url)):
+            return False
+        self.push(self.next_key, url)
+        self.next_key += 1
+        return True
+
+    def requeue(self, url):
+        """Queue a url ahead of all others, e.g. one a resumed crawl had in flight."""
+        self.first_key -= 1
+        self.push(self.first_key, url)
+
+    def push(self, key, url):
+        host = host_of(url)
+        queue = self.hosts.setdefault(host, [])
+        heapq.heappush(queue, (key, url))
+        if queue[0][0] == key:
+            heapq.heappush(self.heads, (key, host))
+        self.size += 1
+
+    def is_head(self, key, host) -> bool:
+        queue = self.hosts.get(host)
+        return queue is not None and queue[0][0] == key
+
+    def take(self, host):
+        """Pop a host's first url."""
+        queue = self.hosts[host]
+        url = heapq.heappop(queue)[1]
+        if queue:
+            heapq.heappush(self.heads, (queue[0][0], host))
+        else:
+            del self.hosts[host]
+        self.size -= 1
+        return url
+
+    def peek(self):
+        """The url pop would return next."""
+        while not self.is_head(*self.heads[0]):
+            heapq.heappop(self.heads)
+        return self.hosts[self.heads[0][1]][0][1]
+
+    def pop(self):
+        """Pop the next url to crawl."""
+        while self.heads:
+            key, host = heapq.heappop(self.heads)
+            if self.is_head(key, host):
+                return self.take(host)
+        raise IndexError("pop from an empty frontier")
+
+    def pop_first(self, predicate):
+        """Pop the first url matching the predicate, or None if there isn't one.
+
+        Only each host's first url is tested, so the predicate should hold
+        for a whole host at a time, as "this host isn't rate limited" does.
+        """
+        skipped = []
+        url = None
+        while self.heads:
+            key, host = heapq.heappop(self.heads)
+            if not self.is_head(key, host):
+                continue
+            if predicate(self.hosts[host][0][1]):
+                url = self.take(host)
+                break
+            skipped.append((key, host))
+        for entry in skipped:
+            heapq.heappush(self.heads, entry)
+        return url
+
+    def mark_done(self, url, counted=True):
+        """Record that a popped url is finished; counted is False if it was skipped."""
+        if counted:
+            self.done += 1
+
+    def close(self):
+        pass
+
+    def __contains__(self, url):
+        return url_key(url) in self.visited
+
+    def __len__(self):
+        return self.size
+
+    def __bool__(self):
+        return self.size > 0
+
+
+class PriorityFrontier(Frontier):
+    """Best-first crawl frontier: the highest scoring url is popped first.
+
+    Each host's urls are kept in a heap by score, and another heap holds each
+    host's best url, so adding and popping are O(log n) and pop_first, which
+    skips rate limited hosts, only tests one url per host. Urls with equal
+    scores come out in the order they were added. The depth each url was
+    found at is kept until it is done, for depth limits.
+    """
+
+    def __init__(self, seeds=(), visited=None):
+        super().__init__(visited=visited)
+        self.depths = {}
+        for url in seeds:
+            self.add(url)
+
+    def add(self, url, score=0.0, depth=0) -> bool:
+        if not self.visited.add(url_key(url)):
+            return False
+        self.push((-score, self.next_key), url)
+        self.next_key += 1
+        self.depths[url] = depth
+        return True
+
+    def depth(self, url) -> int:
+        return self.depths.get(url, 0)
+
+    def mark_done(self, url, counted=True):
+        super().mark_done(url, counted)
+        self.depths.pop(url, None)
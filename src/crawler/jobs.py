@@ -0,0 +1,195 @@
+import os
+import time
+
+
+class JobStore:
+    """Progress and results of asynchronous crawl jobs.
+
+    Backed by any dict-like mapping; on Modal that is a `modal.Dict` shared by
+    the web app and the scrape_url containers. Every seed of a job is crawled
+    by its own container, so each seed only writes keys of its own and no two
+    containers ever update the same key:
+
+        {job_id}                     job metadata
+        {job_id}/seeds/{i}           progress of seed i
+        {job_id}/results/{i}/{n}     n-th page scraped from seed i
+
+    A seed's container records a heartbeat as it goes; only once a running
+    seed's heartbeat has gone stale, or the seed has failed, may resume_seed
+    hand the seed to a new container. Queued seeds haven't got a container
+    yet, however long they wait for one, so they never go stale.
+    """
+
+    # seconds without a heartbeat after which a running seed's container is presumed dead
+    stale_after = 600
+
+    def __init__(self, store):
+        self.store = store
+
+    def create(self, job_id, seeds, request=None):
+        """Store a new job; request is what's needed to restart its seeds."""
+        self.store[job_id] = {
+            "job_id": job_id,
+            "seeds": list(seeds),
+            "created_at": time.time(),
+            "request": request,
+        }
+        for seed_index, seed in enumerate(seeds):
+            self.store[f"{job_id}/seeds/{seed_index}"] = {
+                "seed": seed,
+                "status": "queued",
+                "pages_done": 0,
+                "pages_failed": 0,
+                "queued": 1,
+                "error": None,
+                "budget": None,
+                "heartbeat": time.time(),
+            }
+
+    def exists(self, job_id) -> bool:
+        return job_id in self.store
+
+    def seed_progress(self, job_id, seed_index) -> dict:
+        return self.store[f"{job_id}/seeds/{seed_index}"]
+
+    def update_seed(self, job_id, seed_index, **changes):
+        key = f"{job_id}/seeds/{seed_index}"
+        progress = self.store[key]
+        progress.update(changes)
+        self.store[key] = progress
+        return progress
+
+    def request(self, job_id) -> dict:
+        return self.store[job_id]["request"]
+
+    def is_stale(self, progress) -> bool:
+        return time.time() - progress.get("heartbeat", 0) > self.stale_after
+
+    def resumable_seeds(self, job_id) -> tuple:
+        """Split the seeds that haven't finished into those that can be resumed and those still live.
+
+        A seed can be resumed if it failed, or if it is running but its
+        heartbeat has gone stale.
+
+        Returns:
+            A (resumable, live) tuple of seed indices.
+        """
+        resumable, live = [], []
+        for seed_index in range(len(self.store[job_id]["seeds"])):
+            progress = self.seed_progress(job_id, seed_index)
+            if progress["status"] == "failed" or (progress["status"] == "running" and self.is_stale(progress)):
+                resumable.append(seed_index)
+            elif progress["status"] != "done":
+                live.append(seed_index)
+        return resumable, live
+
+    def resume_seed(self, job_id, seed_index):
+        """Queue a resumable seed again, so it isn't resumed twice before its new container starts."""
+        self.update_seed(job_id, seed_index, status="queued", heartbeat=time.time())
+
+    def start_seed(self, job_id, seed_index):
+        # a resumed seed starts without the error or budget record of its last run
+        self.update_seed(job_id, seed_index, status="running", error=None, budget=None, heartbeat=time.time())
+
+    def recorded_urls(self, job_id, seed_index) -> set:
+        """Urls of the pages already recorded for a seed, e.g. before it was resumed."""
+        progress = self.seed_progress(job_id, seed_index)
+        count = progress["pages_done"] + progress["pages_failed"]
+        return {self.store[f"{job_id}/results/{seed_index}/{n}"]["url"] for n in range(count)}
+
+    def record_page(self, job_id, seed_index, url, scraped, queued):
+        """Store a scraped page and update the seed's progress.
+
+        Pages whose plugin raised come back as an empty result and are counted
+        as failed.
+        """
+        progress = self.seed_progress(job_id, seed_index)
+        n = progress["pages_done"] + progress["pages_failed"]
+        self.store[f"{job_id}/results/{seed_index}/{n}"] = {
+            "seed": progress["seed"],
+            "url": url,
+            "result": scraped,
+        }
+        if scraped:
+            progress["pages_done"] += 1
+        else:
+            progress["pages_failed"] += 1
+        progress["queued"] = queued
+        progress["heartbeat"] = time.time()
+        self.store[f"{job_id}/seeds/{seed_index}"] = progress
+
+    def finish_seed(self, job_id, seed_index, error=None, budget=None, checkpoint_path=None):
+        """Mark a seed done, or failed with error.
+
+        A seed whose crawl ran out of budget is done, with the record of which
+        limit ran out as its budget. A done seed is never resumed, so its
+        checkpoint file, if it has one, is deleted; a failed seed keeps it.
+        """
+        if error is None:
+            self.update_seed(job_id, seed_index, status="done", queued=0, budget=budget)
+            if checkpoint_path is not None:
+                try:
+                    os.remove(checkpoint_path)
+                except FileNotFoundError:
+                    pass
+        else:
+            self.update_seed(job_id, seed_index, status="failed", queued=0, error=str(error))
+
+    def status(self, job_id) -> dict:
+        job = self.store[job_id]
+        seeds = [self.seed_progress(job_id, i) for i in range(len(job["seeds"]))]
+        finished = [seed for seed in seeds if seed["status"] in ("done", "failed")]
+        return {
+            "job_id": job_id,
+            "status": "completed" if len(finished) == len(seeds) else "running",
+            "created_at": job["created_at"],
+            "seeds": len(seeds),
+            "seeds_done": len(finished),
+            "seeds_failed": sum(seed["status"] == "failed" for seed in seeds),
+            "pages_done": sum(seed["pages_done"] for seed in seeds),
+            "pages_failed": sum(seed["pages_failed"] for seed in seeds),
+            "queued": sum(seed["queued"] for seed in seeds),
+            "errors": {seed["seed"]: seed["error"] for seed in seeds if seed["error"]},
+            "budgets_exhausted": {seed["seed"]: seed["budget"]["exhausted"] for seed in seeds if seed.get("budget")},
+        }
+
+    def results(self, job_id, cursor=None, page_size=20) -> dict:
+        """Up to page_size of a job's results that come after cursor.
+
+        Each seed's results are only ever appended to, so the cursor holds
+        how many results of each seed have been returned, e.g. "3.0.5", and
+        pages stay put while the job is running. Pass the returned cursor to
+        get the next results; keep polling with it until the job has
+        completed and no more results come back.
+
+        Raises:
+            ValueError: If cursor isn't one returned for this job.
+        """
+        job = self.store[job_id]
+        offsets = parse_cursor(cursor, len(job["seeds"]))
+        keys = []
+        total = 0
+        for seed_index in range(len(job["seeds"])):
+            progress = self.seed_progress(job_id, seed_index)
+            count = progress["pages_done"] + progress["pages_failed"]
+            total += count
+            while offsets[seed_index] < count and len(keys) < page_size:
+                keys.append(f"{job_id}/results/{seed_index}/{offsets[seed_index]}")
+                offsets[seed_index] += 1
+
+        return {
+            "job_id": job_id,
+            "total": total,
+            "results": [self.store[key] for key in keys],
+            "cursor": ".".join(str(offset) for offset in offsets),
+        }
+
+
+def parse_cursor(cursor, num_seeds) -> list:
+    """The per-seed offsets of a results cursor; None starts at the beginning."""
+    if cursor is None:
+        return [0] * num_seeds
+    offsets = cursor.split(".")
+    if len(offsets) != num_seeds or not all(offset.isdigit() for offset in offsets):
+        raise ValueError(f"Invalid cursor {cursor}")
+    return [int(offset) for offset in offsets]
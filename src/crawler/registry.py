@@ -0,0 +1,68 @@
+import posixpath
+from urllib3.util import parse_url
+
+
+def normalize_hostname(hostname):
+    """Lowercase a hostname and drop a trailing dot and a leading "www." label."""
+    hostname = hostname.lower().rstrip(".")
+    if hostname.startswith("www."):
+        hostname = hostname[len("www."):]
+    return hostname
+
+
+class PluginRegistry:
+    """Routes urls to plugin names, built once from the plugin manifest.
+
+    Plugins claim urls by domain. A domain also matches its subdomains, so
+    "youtube.com" handles m.youtube.com, and the longest matching domain
+    wins. An entry may include a path prefix, as in
+    "docs.google.com/spreadsheets", to only claim part of a site. Plugins can
+    also claim file extensions anywhere, e.g. [".pdf"]; domain matches take
+    precedence over these. A "*" domain makes a plugin the fallback for
+    everything else.
+
+    Domains are indexed by their labels in reverse, so a lookup costs one
+    dict probe per hostname label rather than a scan over every plugin.
+    """
+
+    def __init__(self):
+        # reversed hostname labels -> [(path prefix, plugin name)], longest prefix first
+        self.domains = {}
+        self.extensions = {}
+        self.default = None
+
+    def register(self, plugin, domains, extensions=()):
+        """Index a plugin's domains and extensions. Earlier plugins win ties."""
+        for domain in domains:
+            if domain == "*":
+                self.default = self.default or plugin
+                continue
+            hostname, _, path = domain.partition("/")
+            key = tuple(reversed(normalize_hostname(hostname).split(".")))
+            rules = self.domains.setdefault(key, [])
+            rules.append(("/" + path.strip("/") if path else "", plugin))
+            rules.sort(key=lambda rule: len(rule[0]), reverse=True)
+
+        for extension in extensions:
+            self.extensions.setdefault("." + extension.lower().lstrip("."), plugin)
+
+    def match_domain(self, hostname, path):
+        labels = tuple(reversed(normalize_hostname(hostname).split(".")))
+        # most specific domain first: m.youtube.com, then youtube.com, then com
+        for depth in range(len(labels), 0, -1):
+            for prefix, plugin in self.domains.get(labels[:depth], []):
+                if path == prefix or path.startswith(prefix + "/") or not prefix:
+                    return plugin
+        return None
+
+    def lookup(self, url):
+        """The plugin that should handle a url, or the fallback plugin if none claims it."""
+        parsed_url = parse_url(url)
+        path = parsed_url.path or "/"
+        plugin = None
+        if parsed_url.hostname:
+            plugin = self.match_domain(parsed_url.hostname, path)
+        if plugin is None and self.extensions:
+            extension = posixpath.splitext(path)[1].lower()
+            plugin = self.extensions.get(extension)
+        return plugin or self.default
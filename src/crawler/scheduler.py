@@ -0,0 +1,166 @@
+import threading
+import time
+from contextlib import contextmanager
+from urllib.robotparser import RobotFileParser
+
+from urllib3.util import parse_url
+
+from plugins.http_client import http_client
+
+
+class TokenBucket:
+    """Token bucket refilled at `rate` tokens per second, holding at most `capacity`."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount=1) -> float:
+        """Seconds until `amount` tokens are available.
+
+        Amounts larger than the bucket only wait for a full bucket; taking
+        them leaves the bucket in debt, so later takes wait until it is paid
+        off and the rate still holds.
+        """
+        needed = min(amount, self.capacity)
+        self.refill()
+        if self.tokens >= needed:
+            return 0.0
+        return (needed - self.tokens) / self.rate
+
+    def take(self, amount=1) -> bool:
+        if self.delay(amount) > 0:
+            return False
+        self.tokens -= amount
+        return True
+
+
+class HostState:
+    def __init__(self, rate, burst):
+        self.bucket = TokenBucket(rate, burst)
+        self.in_flight = 0
+        self.robots = None
+        self.robots_lock = threading.Lock()
+
+
+class HostScheduler:
+    """Per-host politeness for recursive crawls.
+
+    Each host gets a token bucket limiting how often a page may be started and
+    a cap on how many of its pages may be in flight at once. robots.txt is
+    fetched once per host; disallowed urls are skipped and a crawl-delay slows
+    that host's bucket down. Other hosts are unaffected, so a crawl frontier
+    can keep working on them while one host is waiting.
+    """
+
+    def __init__(self, rate=2.0, burst=2, max_in_flight_per_host=4, respect_robots=True, user_agent="Beatnik", robots_timeout=5):
+        self.rate = rate
+        self.burst = burst
+        self.max_in_flight_per_host = max_in_flight_per_host
+        self.respect_robots = respect_robots
+        self.user_agent = user_agent
+        self.robots_timeout = robots_timeout
+        self.hosts = {}
+        self.lock = threading.Lock()
+
+    def get_host(self, url):
+        return (parse_url(url).hostname or "").lower()
+
+    def host_state(self, url) -> HostState:
+        host = self.get_host(url)
+        with self.lock:
+            if host not in self.hosts:
+                self.hosts[host] = HostState(self.rate, self.burst)
+            return self.hosts[host]
+
+    def fetch_robots(self, url) -> RobotFileParser:
+        parsed_url = parse_url(url)
+        robots_url = f"{parsed_url.scheme}://{parsed_url.netloc}/robots.txt"
+        robots = RobotFileParser(robots_url)
+        try:
+            r = http_client.get(robots_url, timeout=self.robots_timeout)
+            # same semantics as RobotFileParser.read
+            if r.status_code in (401, 403):
+                robots.disallow_all = True
+            elif r.status_code >= 400:
+                robots.allow_all = True
+            else:
+                robots.parse(r.text.splitlines())
+        except Exception as e:
+            print(e)
+            robots.allow_all = True
+        return robots
+
+    def get_robots(self, url) -> RobotFileParser:
+        """robots.txt for the url's host, fetched on first use and cached."""
+        state = self.host_state(url)
+        with state.robots_lock:
+            if state.robots is None:
+                state.robots = self.fetch_robots(url)
+                crawl_delay = state.robots.crawl_delay(self.user_agent)
+                if crawl_delay:
+                    with self.lock:
+                        state.bucket.rate = min(state.bucket.rate, 1 / float(crawl_delay))
+                        state.bucket.capacity = 1
+                        state.bucket.tokens = min(state.bucket.tokens, 1)
+            return state.robots
+
+    def allowed(self, url) -> bool:
+        """Whether robots.txt lets us fetch the url. Blocks on the first url of each host."""
+        if not self.respect_robots:
+            return True
+        return self.get_robots(url).can_fetch(self.user_agent, url)
+
+    def delay(self, url) -> float:
+        """Seconds until a page of the url's host may start, inf if the host is at its in-flight cap."""
+        state = self.host_state(url)
+        with self.lock:
+            if state.in_flight >= self.max_in_flight_per_host:
+                return float("inf")
+            return state.bucket.delay()
+
+    def next_delay(self):
+        """Shortest finite delay across known hosts, or None if every host is ready or at its cap."""
+        with self.lock:
+            delays = [
+                state.bucket.delay()
+                for state in self.hosts.values()
+                if state.in_flight < self.max_in_flight_per_host
+            ]
+        delays = [delay for delay in delays if delay > 0]
+        return min(delays) if delays else None
+
+    def try_acquire(self, url) -> bool:
+        """Start a page of the url's host if it is ready, without blocking."""
+        state = self.host_state(url)
+        with self.lock:
+            if state.in_flight >= self.max_in_flight_per_host or not state.bucket.take():
+                return False
+            state.in_flight += 1
+            return True
+
+    def acquire(self, url):
+        """Block until a page of the url's host may start."""
+        while not self.try_acquire(url):
+            delay = self.delay(url)
+            time.sleep(min(delay, 0.1) if delay > 0 else 0.01)
+
+    def release(self, url):
+        state = self.host_state(url)
+        with self.lock:
+            state.in_flight -= 1
+
+    @contextmanager
+    def slot(self, url):
+        self.acquire(url)
+        try:
+            yield
+        finally:
+            self.release(url)
@@ -0,0 +1,96 @@
+import re
+from urllib.parse import unquote, urlsplit
+
+from .registry import normalize_hostname
+
+# urls that are rarely worth a page of the crawl budget: accounts, legal and
+# site chrome, wiki namespaces other than articles, feeds and listings
+AVOID_PATTERNS = [
+    r"/(log-?in|log-?out|sign-?in|sign-?up|register|account|cart|checkout)\b",
+    r"/(privacy|terms|legal|cookies?|disclaimer|copyright)\b",
+    r"/(search|share|print|feed|rss|sitemap|tags?|wp-admin|wp-login)\b",
+    r"/wiki/(Special|Talk|User|User_talk|Wikipedia|Help|Portal|Template|Category|File|Draft|Module):",
+    r"[?&](action|oldid|diff|printable|redlink|sort|order|page)=",
+    r"/page/\d+",
+]
+
+# anchor texts of navigation links rather than content
+NAVIGATION_TEXTS = {
+    "home", "next", "previous", "prev", "more", "here", "click here", "read more",
+    "log in", "login", "sign in", "sign up", "register", "privacy", "privacy policy",
+    "terms", "terms of use", "cookies", "contact", "contact us", "about", "about us",
+    "help", "edit", "share", "top", "back to top", "menu", "skip to content",
+}
+
+
+class LinkScorer:
+    """Scores the links of a "BestFirst" crawl; higher scoring links are crawled first.
+
+    A score adds up weighted signals:
+
+        depth        -1 per link followed from the seed
+        same_domain  +1 if the link stays on the host of the page it was found on
+        pattern      -1 if the url matches an avoid pattern, +1 for a prefer pattern
+        anchor       -1 for navigation text like "Log in" or "Next",
+                     up to +1 for longer, descriptive text
+        keyword      +1 per keyword found in the anchor text or url
+
+    Weights and patterns can be changed per crawl; for other signals,
+    subclass it and override score, or pass any object with the same score
+    method to BeatnikScraper.
+
+    Args:
+        keywords: Words the pages we want are likely to mention.
+        prefer_patterns: Regexes for urls to crawl sooner.
+        avoid_patterns: Regexes for urls to crawl later, AVOID_PATTERNS by default.
+        weights: Overrides of the default weight of each signal.
+    """
+
+    WEIGHTS = {
+        "depth": 1.0,
+        "same_domain": 1.0,
+        "pattern": 2.0,
+        "anchor": 1.0,
+        "keyword": 1.5,
+    }
+
+    def __init__(self, keywords=(), prefer_patterns=(), avoid_patterns=AVOID_PATTERNS, weights=None):
+        self.keywords = [keyword.lower() for keyword in keywords if keyword]
+        self.prefer = [re.compile(pattern, re.IGNORECASE) for pattern in prefer_patterns]
+        self.avoid = [re.compile(pattern, re.IGNORECASE) for pattern in avoid_patterns]
+        self.weights = {**self.WEIGHTS, **(weights or {})}
+
+    def pattern_score(self, url) -> float:
+        score = 0.0
+        if any(pattern.search(url) for pattern in self.avoid):
+            score -= 1.0
+        if any(pattern.search(url) for pattern in self.prefer):
+            score += 1.0
+        return score
+
+    def anchor_score(self, anchor_text) -> float:
+        text = " ".join(anchor_text.split()).lower()
+        if not text:
+            return 0.0
+        if text in NAVIGATION_TEXTS:
+            return -1.0
+        # descriptive anchors are usually a few words long
+        return min(len(text.split()), 4) / 4
+
+    def keyword_score(self, url, anchor_text) -> float:
+        haystack = (unquote(url) + " " + anchor_text).lower().replace("_", " ")
+        return float(sum(keyword in haystack for keyword in self.keywords))
+
+    def score(self, url, depth, parent_url=None, anchor_text=None) -> float:
+        """Score a link found at `depth` on the page parent_url."""
+        anchor_text = anchor_text or ""
+        score = -self.weights["depth"] * depth
+        if parent_url is not None:
+            host = normalize_hostname(urlsplit(url).hostname or "")
+            parent_host = normalize_hostname(urlsplit(parent_url).hostname or "")
+            if host == parent_host:
+                score += self.weights["same_domain"]
+        score += self.weights["pattern"] * self.pattern_score(url)
+        score += self.weights["anchor"] * self.anchor_score(anchor_text)
+        score += self.weights["keyword"] * self.keyword_score(url, anchor_text)
+        return score
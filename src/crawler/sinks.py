@@ -0,0 +1,244 @@
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+import weakref
+
+
+def json_default(value):
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    return str(value)
+
+
+def to_jsonl(records) -> str:
+    return "".join(json.dumps(record, default=json_default) + "\n" for record in records)
+
+
+class ResultSink:
+    """Where a crawl writes its scraped pages.
+
+    Records are {"url", "result"} dicts. Sinks may be written to from several
+    threads at once. `close()` is called when a crawl finishes and must leave
+    every record written so far persisted; a sink can be written to again
+    after it has been closed.
+    """
+
+    def write(self, record):
+        raise NotImplementedError
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.flush()
+
+
+class JsonlSink(ResultSink):
+    """Appends records to part-{sink id}-{n}.jsonl files in a local directory.
+
+    A new part is started after every close, so each crawl gets its own file.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.sink_id = uuid.uuid4().hex[:8]
+        self.parts = 0
+        self.file = None
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        with self.lock:
+            if self.file is None:
+                os.makedirs(self.directory, exist_ok=True)
+                path = os.path.join(self.directory, f"part-{self.sink_id}-{self.parts:05d}.jsonl")
+                self.parts += 1
+                self.file = open(path, "a", encoding="utf-8")
+            self.file.write(json.dumps(record, default=json_default) + "\n")
+
+    def flush(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+class ParquetSink(ResultSink):
+    """Writes records to compressed part-{sink id}-{n}.parquet files in a local directory.
+
+    The fields most analyses need (summary, content, raw_source) get columns
+    of their own so they can be read without the rest; the full result is
+    kept as JSON in the `result` column. Rows are buffered and written
+    `row_group_size` at a time, and a file is finished when the sink is
+    closed. Needs pyarrow.
+    """
+
+    COLUMNS = ["url", "summary", "content", "raw_source", "result"]
+
+    def __init__(self, directory, row_group_size=1000, compression="zstd"):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa = pa
+        self.pq = pq
+        self.schema = pa.schema([(column, pa.string()) for column in self.COLUMNS])
+        self.directory = directory
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.sink_id = uuid.uuid4().hex[:8]
+        self.parts = 0
+        self.rows = []
+        self.writer = None
+        self.lock = threading.Lock()
+
+    def to_column(self, value):
+        if value is None or isinstance(value, str):
+            return value
+        return json.dumps(value, default=json_default)
+
+    def write(self, record):
+        result = record.get("result") or {}
+        with self.lock:
+            self.rows.append(
+                {
+                    "url": record.get("url"),
+                    "summary": self.to_column(result.get("summary")),
+                    "content": self.to_column(result.get("content")),
+                    "raw_source": self.to_column(result.get("raw_source")),
+                    "result": self.to_column(result),
+                }
+            )
+            if len(self.rows) >= self.row_group_size:
+                self.write_row_group()
+
+    def write_row_group(self):
+        if not self.rows:
+            return
+        if self.writer is None:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"part-{self.sink_id}-{self.parts:05d}.parquet")
+            self.parts += 1
+            self.writer = self.pq.ParquetWriter(path, self.schema, compression=self.compression)
+        self.writer.write_table(self.pa.Table.from_pylist(self.rows, schema=self.schema))
+        self.rows = []
+
+    def flush(self):
+        with self.lock:
+            self.write_row_group()
+
+    def close(self):
+        with self.lock:
+            self.write_row_group()
+            if self.writer is not None:
+                self.writer.close()
+                self.writer = None
+
+
+class BatchedResultWriter(ResultSink):
+    """Writes scraped records as JSONL shards from a background thread.
+
+    Records are buffered and uploaded `batch_size` at a time, or whatever has
+    been buffered once `flush_interval` seconds pass without a full batch, so
+    uploads stay off the crawl's critical path. Each writer names its shards
+    `{prefix}part-{writer id}-{shard number}.jsonl`.
+
+    The thread is started on the first write. `flush()` blocks until
+    everything written so far has been uploaded; `close()` also stops the
+    thread until the next write. All open writers are closed, and so flushed,
+    when the interpreter exits.
+
+    Args:
+        upload: Callable taking (shard name, contents) which stores a shard.
+        prefix: Prepended to every shard name, e.g. "{run_id}/successes/".
+    """
+
+    def __init__(self, upload, prefix="", batch_size=100, flush_interval=5.0, max_retries=3):
+        self.upload = upload
+        self.prefix = prefix
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.writer_id = uuid.uuid4().hex[:8]
+        self.shards = 0
+        self.records = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.work, daemon=True)
+                self.thread.start()
+                open_writers.add(self)
+            self.records.put(record)
+
+    def flush(self):
+        """Block until every record written so far has been uploaded."""
+        with self.lock:
+            if self.thread is None:
+                return
+            flushed = threading.Event()
+            self.records.put(flushed)
+        flushed.wait()
+
+    def close(self):
+        """Flush and stop the background thread."""
+        with self.lock:
+            thread, self.thread = self.thread, None
+            if thread is None:
+                return
+            self.records.put(None)
+            open_writers.discard(self)
+        thread.join()
+
+    def work(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while True:
+            try:
+                item = self.records.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = "timeout"
+            if isinstance(item, dict):
+                batch.append(item)
+                if len(batch) < self.batch_size:
+                    continue
+            if batch:
+                self.upload_shard(batch)
+                batch = []
+            deadline = time.monotonic() + self.flush_interval
+            if isinstance(item, threading.Event):
+                item.set()
+            elif item is None:
+                return
+
+    def upload_shard(self, batch):
+        name = f"{self.prefix}part-{self.writer_id}-{self.shards:05d}.jsonl"
+        self.shards += 1
+        contents = to_jsonl(batch)
+        for attempt in range(self.max_retries + 1):
+            try:
+                self.upload(name, contents)
+                return
+            except Exception as e:
+                print(e)
+                if attempt < self.max_retries:
+                    time.sleep(2 ** attempt)
+        print(f"Could not upload {name}, {len(batch)} records lost")
+
+
+open_writers = weakref.WeakSet()
+
+
+@atexit.register
+def close_open_writers():
+    for writer in list(open_writers):
+        writer.close()
@@ -0,0 +1,84 @@
+import posixpath
+from urllib.parse import unquote_plus, urljoin, urlsplit, urlunsplit
+
+# query parameters that only track where a visitor came from
+TRACKING_PARAMS = {"fbclid", "gclid", "dclid", "msclkid", "mc_cid", "mc_eid", "igshid", "ref_src"}
+TRACKING_PREFIXES = ("utm_",)
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+
+
+def is_tracking_param(name: str) -> bool:
+    name = name.lower()
+    return name in TRACKING_PARAMS or name.startswith(TRACKING_PREFIXES)
+
+
+def query_name(segment: str) -> str:
+    """The decoded name of a raw "name=value" query segment."""
+    return unquote_plus(segment.partition("=")[0])
+
+
+def canonicalize_url(url: str, base: str = None):
+    """The canonical spelling of a link, or None if it isn't an http(s) url.
+
+    Resolves the link against the page it was found on, lowercases the scheme
+    and host, drops default ports, fragments and tracking parameters (utm_*,
+    gclid, ...), resolves "." and ".." path segments and sorts the query
+    parameters by name. Query parameters are kept exactly as written, neither
+    decoded nor re-encoded, so the result still points at the same resource
+    and is what gets fetched.
+
+    Args:
+        url: The link, possibly relative.
+        base: The url of the page the link was found on.
+    """
+    if not url:
+        return None
+    try:
+        url = urljoin(base, url.strip()) if base else url.strip()
+        parts = urlsplit(url)
+        port = parts.port
+    except ValueError:
+        return None
+    scheme = parts.scheme.lower()
+    if scheme not in DEFAULT_PORTS or not parts.hostname:
+        return None
+
+    host = parts.hostname.lower().rstrip(".")
+    if ":" in host:
+        host = f"[{host}]"
+    if port and port != DEFAULT_PORTS[scheme]:
+        host = f"{host}:{port}"
+
+    path = parts.path or "/"
+    trailing_slash = path.endswith("/")
+    path = posixpath.normpath(path)
+    # normpath keeps a leading "//" and drops the trailing slash
+    path = "/" + path.lstrip("/")
+    if trailing_slash and path != "/":
+        path += "/"
+
+    query = [
+        segment
+        for segment in parts.query.split("&")
+        if segment and not is_tracking_param(query_name(segment))
+    ]
+    # a stable sort keeps repeated parameters in their original order
+    query.sort(key=query_name)
+    return urlunsplit((scheme, host, path, "&".join(query), ""))
+
+
+
+def url_key(url: str) -> str:
+    """Key under which spellings of the same page are deduplicated.
+
+    Beyond canonicalize_url, ignores the scheme, a leading "www." and a
+    trailing slash, which almost never name different pages.
+    """
+    canonical = canonicalize_url(url) or url
+    parts = urlsplit(canonical)
+    host = parts.netloc
+    if host.startswith("www."):
+        host = host[len("www."):]
+    path = parts.path.rstrip("/")
+    return host + path + ("?" + parts.query if parts.query else "")
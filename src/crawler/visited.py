@@ -0,0 +1,87 @@
+import hashlib
+import math
+
+
+class ExactVisitedSet:
+    """Remembers every key it has seen, exactly."""
+
+    def __init__(self):
+        self.keys = set()
+
+    def add(self, key) -> bool:
+        """Remember a key.
+
+        Returns:
+            True if the key hadn't been seen before.
+        """
+        if key in self.keys:
+            return False
+        self.keys.add(key)
+        return True
+
+    def __contains__(self, key):
+        return key in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+
+class BloomVisitedSet:
+    """Remembers keys in a fixed amount of memory using a Bloom filter.
+
+    Never forgets a key, but may wrongly claim to have seen a new one with
+    probability about `error_rate` while it holds at most `capacity` keys,
+    and more often past that. For a crawl that means occasionally skipping
+    a page rather than fetching one twice. A million keys at a 0.1% error
+    rate take about 1.8MB.
+    """
+
+    def __init__(self, capacity=1_000_000, error_rate=0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.num_bits = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = bytearray((self.num_bits + 7) // 8)
+        self.count = 0
+
+    def positions(self, key):
+        # double hashing: bit i is h1 + i * h2
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, key) -> bool:
+        """Remember a key.
+
+        Returns:
+            True if the key (probably) hadn't been seen before.
+        """
+        new = False
+        for position in self.positions(key):
+            byte, bit = divmod(position, 8)
+            if not self.bits[byte] & (1 << bit):
+                self.bits[byte] |= 1 << bit
+                new = True
+        if new:
+            self.count += 1
+        return new
+
+    def __contains__(self, key):
+        return all(self.bits[position // 8] & (1 << position % 8) for position in self.positions(key))
+
+    def __len__(self):
+        return self.count
+
+
+VISITED_SETS = {
+    "exact": ExactVisitedSet,
+    "bloom": BloomVisitedSet,
+}
+
+
+def create_visited_set(mode="exact", **kwargs):
+    """A visited set by mode name: "exact", or "bloom" which takes capacity and error_rate."""
+    if mode not in VISITED_SETS:
+        raise ValueError(f"Unknown visited set {mode}")
+    return VISITED_SETS[mode](**kwargs)
@@ -1,7 +1,16 @@
-import importlib
+import asyncio
+import hashlib
+import json
 import os
-from fastapi import FastAPI
-from pydantic import BaseModel
+import queue
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, confloat, conint
+from typing import List, Literal, Optional
 import modal
 from azure.identity import DefaultAzureCredential
 from azure.storage.blob import BlobServiceClient, BlobClient, ContainerClient
@@ -10,6 +19,24 @@ from datetime import datetime
 
 from urllib3.util import parse_url
 
+from crawler.budget import CrawlBudget, use_budget
+from crawler.checkpoint import CheckpointFrontier
+from crawler.distributed import ShardFrontier, delete_run
+from crawler.frontier import Frontier, PriorityFrontier
+from crawler.jobs import JobStore
+from crawler.registry import PluginRegistry, normalize_hostname
+from crawler.scheduler import HostScheduler
+from crawler.scoring import LinkScorer
+from crawler.sinks import BatchedResultWriter, JsonlSink, ParquetSink, json_default
+from crawler.urls import canonicalize_url, url_key
+from crawler.visited import create_visited_set
+from plugins.browser_pool import browser_pool
+from plugins.fetch import FetchResult
+from plugins.fetch_cache import CACHE_DIR
+from plugins.http_client import http_client
+from plugins.manifest import PLUGINS, load_plugin_class
+from plugins.process_pool import process_pool
+
 image = (
     modal.Image.debian_slim()
     .run_commands(
@@ -21,6 +48,7 @@ image = (
     .pip_install_from_requirements("./requirements.txt")
     .run_commands(
         "python -m nltk.downloader punkt",
+        "python -c \"import tiktoken; tiktoken.get_encoding('p50k_base')\"",
         "playwright install-deps",
         "playwright install",
     )
@@ -30,6 +58,28 @@ stub = modal.Stub("beatnik", image=image)
 stub["openai-secret"] = modal.Secret({"OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY")})
 stub["azure-beatnik-storage-connection-string"] = modal.Secret({"CONNECTION_STRING": os.environ.get("CONNECTION_STRING")})
 
+# progress and results of crawl jobs submitted to /jobs
+stub.jobs = modal.Dict()
+
+# mailboxes and statuses of distributed crawls, see crawler.distributed
+stub.crawls = modal.Dict()
+
+# persists results written by the local jsonl and parquet sinks
+stub.results_volume = modal.SharedVolume().persist("beatnik-results")
+
+# persists plugins.fetch_cache across runs
+stub.fetch_cache_volume = modal.SharedVolume().persist("beatnik-fetch-cache")
+fetch_cache_volumes = {
+    "/root/.cache/beatnik": stub.fetch_cache_volume,
+    "/root/results": stub.results_volume,
+}
+
+# local packages imported by every function
+local_mounts = [
+    modal.Mount(local_dir="./plugins", remote_dir="/root/plugins"),
+    modal.Mount(local_dir="./crawler", remote_dir="/root/crawler"),
+]
+
 app = FastAPI()
 
 @app.get("/")
@@ -37,9 +87,29 @@ async def root():
     return {"message": "Beatnik A.I."}
 
 class AzureIOManager:
+    # one manager, and so one BlobServiceClient and its connection pool, per
+    # connection string for the life of the container
+    _shared = {}
+    _shared_lock = threading.Lock()
+
     def __init__(self, connection_string):
         self.connection_string = connection_string
         self.blob_service_client = BlobServiceClient.from_connection_string(self.connection_string)
+        self.container_clients = {}
+
+    @classmethod
+    def shared(cls, connection_string=None):
+        """The container-wide manager for a connection string, CONNECTION_STRING by default."""
+        connection_string = connection_string or os.environ.get("CONNECTION_STRING")
+        with cls._shared_lock:
+            if connection_string not in cls._shared:
+                cls._shared[connection_string] = cls(connection_string)
+            return cls._shared[connection_string]
+
+    def get_container_client(self, container_name):
+        if container_name not in self.container_clients:
+            self.container_clients[container_name] = self.blob_service_client.get_container_client(container_name)
+        return self.container_clients[container_name]
 
     def upload_file(self, container_name, file_path, file_name, contents):
         """
@@ -52,59 +122,147 @@ class AzureIOManager:
         Returns:
             None
         """
-        container_client = self.blob_service_client.get_container_client(container_name)
-        if file_path != "":
+        container_client = self.get_container_client(container_name)
+        if file_path:
             blob_name = file_path + '/' + file_name
         else:
             blob_name = file_name
         blob_client = container_client.get_blob_client(blob_name)
         blob_client.upload_blob(contents)
 
-class BeatnikScraper:
-    def __init__(self, plugin_dir, recursive_mode, maintain_domain, max_urls, save_to_azure, azure_container_name=None, azure_file_path=None):
+    def result_writer(self, container_name, file_path, **kwargs):
+        """A BatchedResultWriter uploading JSONL shards to container_name/file_path."""
+        return BatchedResultWriter(
+            lambda file_name, contents: self.upload_file(container_name, file_path, file_name, contents),
+            **kwargs,
+        )
+
+class PluginSet:
+    """The plugins in a plugin directory and the registry routing urls to them.
+
+    Plugins keep no per-url state (that lives on each url's FetchResult), so
+    one PluginSet is shared by every scraper in the container.
+    """
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    def __init__(self, plugin_dir):
         self.plugin_dir = plugin_dir
         self.available_plugins = {}
+        self.plugins_lock = threading.Lock()
+        self.registry = PluginRegistry()
         self.load_plugins()
-        self.recursive_mode = recursive_mode
-        self.maintain_domain = maintain_domain
-        self.max_urls = max_urls
-        if save_to_azure:
-            self.save_to_azure = True
-            self.azure_io_manager = AzureIOManager(os.environ.get("CONNECTION_STRING"))
-            self.azure_container_name = azure_container_name
-            self.azure_file_path = azure_file_path
-        else:
-            self.save_to_azure = False
+
+    @classmethod
+    def shared(cls, plugin_dir):
+        """The container-wide PluginSet for a plugin directory."""
+        with cls._shared_lock:
+            if plugin_dir not in cls._shared:
+                cls._shared[plugin_dir] = cls(plugin_dir)
+            return cls._shared[plugin_dir]
 
     def load_plugins(self):
-        # TODO: clean this up - it's quite messy
+        """Register the plugin modules in the plugin directory.
+
+        Plugins in the manifest are only imported once a url is routed to them.
+        """
+        # plugin modules are numbered, e.g. "02_youtube.py"; anything else in
+        # the plugin directory is a helper module
         for module_name in sorted(os.listdir(self.plugin_dir)):
-            if (
-                module_name.endswith(".py")
-                and "utils" not in module_name
-                and "__init__" not in module_name
-            ):
-                plugin_module = importlib.import_module(f"plugins.{module_name[:-3]}")
+            if re.match(r"^\d+_\w+\.py$", module_name):
                 plugin_module_name = module_name[:-3]
-                plugin_class_name = plugin_module_name.split("_")[1].capitalize()
-                plugin_class = getattr(plugin_module, f"{plugin_class_name}Plugin")
-                plugin = plugin_class()
-                if plugin_module_name not in self.available_plugins.keys():
-                    self.available_plugins[plugin_module_name] = (
-                        plugin,
+                if plugin_module_name in PLUGINS:
+                    manifest = PLUGINS[plugin_module_name]
+                    self.registry.register(
+                        plugin_module_name,
+                        manifest["domains"],
+                        manifest.get("extensions", []),
+                    )
+                else:
+                    plugin = self.get_plugin(plugin_module_name)
+                    self.registry.register(
+                        plugin_module_name,
                         plugin.supported_domains,
+                        getattr(plugin, "supported_extensions", []),
                     )
 
+    def get_plugin(self, plugin_module_name):
+        """The instance of a plugin, importing and setting it up on first use."""
+        with self.plugins_lock:
+            if plugin_module_name not in self.available_plugins:
+                plugin = load_plugin_class(plugin_module_name)()
+                if hasattr(plugin, "setup_credentials"):
+                    plugin.setup_credentials()
+                self.available_plugins[plugin_module_name] = plugin
+            return self.available_plugins[plugin_module_name]
+
+    def get_proper_handler(self, url):
+        return self.get_plugin(self.registry.lookup(url))
+
+
+class BeatnikScraper:
+    def __init__(
+        self,
+        plugin_dir,
+        recursive_mode,
+        maintain_domain,
+        max_urls,
+        save_to_azure,
+        azure_container_name=None,
+        azure_file_path=None,
+        options=None,
+        sink=None,
+        plugins=None,
+        checkpoint_dir=None,
+        scorer=None,
+    ):
+        """A scraper for one crawl.
+
+        Args:
+            options: The crawl's ScraperOptions, the defaults if None. Its sink
+                and checkpoint fields are ignored; build_scraper turns them
+                into the sink and checkpoint_dir arguments.
+            sink: The ResultSink results are written to.
+            plugins: The PluginSet to route urls with, the container's by default.
+            checkpoint_dir: Where recursive crawls checkpoint their frontier.
+            scorer: Scores links for "BestFirst" crawls, a LinkScorer by default.
+        """
+        options = options or ScraperOptions()
+        self.plugin_dir = plugin_dir
+        # plugins are shared by every scraper in the container unless given
+        self.plugins = plugins or PluginSet.shared(plugin_dir)
+        self.recursive_mode = recursive_mode
+        self.maintain_domain = maintain_domain
+        self.max_urls = max_urls
+        self.num_workers = options.num_workers
+        self.visited_set = options.visited_set
+        self.visited_capacity = options.visited_capacity
+        # recursive crawls checkpoint their frontier here, so they can be resumed
+        self.checkpoint_dir = checkpoint_dir
+        # hostnames a distributed crawl with maintain_domain may follow links to
+        self.seed_domains = None
+        # "BestFirst" crawls follow the best scoring links first, at most max_depth links from the seed
+        self.max_depth = options.max_depth
+        self.scorer = scorer or LinkScorer(keywords=options.link_keywords)
+        # the crawl stops starting pages once any of these runs out
+        self.budget = CrawlBudget(deadline=options.deadline, max_bytes=options.max_bytes, max_tokens=options.max_llm_tokens)
+        self.scheduler = HostScheduler(
+            rate=options.per_host_rate,
+            max_in_flight_per_host=options.per_host_concurrency,
+            respect_robots=options.respect_robots,
+        )
+        # results go to the given ResultSink, or to Azure if save_to_azure is set
+        self.sink = sink
+        if sink is None and save_to_azure:
+            self.sink = AzureIOManager.shared().result_writer(azure_container_name, azure_file_path)
+
     def get_hostname(self, url):
         parsed_url = parse_url(url)
-        return parsed_url.hostname.lower().lstrip("www.")
+        return normalize_hostname(parsed_url.hostname)
 
     def get_proper_handler(self, url):
-        hostname = self.get_hostname(url)
-        for plugin_name, plugin in self.available_plugins.items():
-            if hostname in plugin[1]:
-                return plugin[0]
-        return self.available_plugins["99_default"][0]
+        return self.plugins.get_proper_handler(url)
 
     def is_valid_url(self, url):
         parsed_url = parse_url(url)
@@ -112,78 +270,409 @@ class BeatnikScraper:
             return False
         return True
 
-    def scrape_url(self, url):
+    def scrape_url(self, url, fetched=None):
         if not self.is_valid_url(url):
             return {}
         else:
             plugin = self.get_proper_handler(url)
-            if hasattr(plugin, "setup_credentials"):
-                plugin.setup_credentials()
+            fetched = fetched if fetched is not None else FetchResult(url)
             try:
-                results = plugin.process(url)
+                # downloads and summaries made by the plugin count against the crawl's budget
+                with use_budget(self.budget):
+                    results = plugin.process(url, fetched)
             except Exception as e:
                 print(e)
                 results = {}
+            if fetched.page_source:
+                self.budget.charge_bytes(len(fetched.page_source.encode("utf-8")))
             return results
 
+    def should_follow(self, url, starting_domain):
+        """Whether a discovered link should be added to the crawl frontier."""
+        if url is None or parse_url(url).hostname is None:
+            return False
+        if not self.maintain_domain:
+            return True
+        if self.seed_domains is not None:
+            return self.get_hostname(url) in self.seed_domains
+        return self.get_hostname(url) == starting_domain
+
+    def save_result(self, url, scraped):
+        """Write a page's result to the sink; sinks may persist it later."""
+        if self.sink is not None:
+            self.sink.write({"url": url, "result": scraped})
+
+    def flush_results(self):
+        """Persist every result written so far by closing the sink until its next write."""
+        if self.sink is not None:
+            self.sink.close()
+
+    def crawl_page(self, url):
+        """Scrape a single page of a recursive crawl and collect its outgoing links.
+
+        Both the plugin's process and get_links see the same FetchResult, so the
+        page is only downloaded and rendered once.
+
+        Returns:
+            A (scraped, links) tuple.
+        """
+        fetched = FetchResult(url)
+        scraped = self.scrape_url(url, fetched)
+        self.save_result(url, scraped)
+        links = self.get_page_links(url, fetched)
+        return scraped, links
+
+    def get_page_links(self, url, fetched):
+        """The page's links, canonicalized and without duplicates or non-http(s) links."""
+        links = []
+        plugin = self.get_proper_handler(url)
+        if hasattr(plugin, "get_links"):
+            try:
+                with use_budget(self.budget):
+                    links = plugin.get_links(url, fetched) or []
+            except Exception as e:
+                print(e)
+        canonical_links = {canonicalize_url(link, base=url) for link in links}
+        canonical_links.discard(None)
+        return sorted(canonical_links)
+
+    def enqueue_links(self, frontier, url, links, starting_domain, fetched=None):
+        """Add the links of a crawled page to the frontier.
+
+        A PriorityFrontier gets each link's score and depth, and links deeper
+        than max_depth are left out.
+        """
+        if not isinstance(frontier, PriorityFrontier):
+            for link in links:
+                if self.should_follow(link, starting_domain):
+                    frontier.add(link)
+            return
+
+        depth = frontier.depth(url) + 1
+        if self.max_depth is not None and depth > self.max_depth:
+            return
+        anchors = {}
+        if fetched is not None and fetched.anchors:
+            anchors = {canonicalize_url(href, base=url): text for href, text in fetched.anchors.items()}
+        for link in links:
+            if self.should_follow(link, starting_domain):
+                score = self.scorer.score(link, depth, parent_url=url, anchor_text=anchors.get(link))
+                frontier.add(link, score=score, depth=depth)
+
+    def new_visited_set(self):
+        if self.visited_set == "bloom":
+            return create_visited_set("bloom", capacity=self.visited_capacity)
+        return create_visited_set(self.visited_set)
+
+    def new_frontier(self, url):
+        """A crawl frontier seeded with url, deduplicating with the configured visited set.
+
+        With a checkpoint_dir, the frontier is checkpointed to a file named
+        after the seed, and resumed from it if it already exists. "BestFirst"
+        crawls use a PriorityFrontier, which can't be checkpointed; the API
+        rejects that combination (see reject_unsupported_options).
+        """
+        visited = self.new_visited_set()
+        if self.recursive_mode == "BestFirst":
+            return PriorityFrontier([url], visited=visited)
+        if self.checkpoint_dir is None:
+            return Frontier([url], visited=visited)
+        seed_hash = hashlib.sha256(url_key(url).encode("utf-8")).hexdigest()[:16]
+        path = os.path.join(self.checkpoint_dir, f"{seed_hash}.sqlite")
+        return CheckpointFrontier(path, [url], visited=visited)
+
     def scrape(self, url):
-        starting_domain = parse_url(url).hostname.lower().lstrip("www.")
+        """Scrape url, or crawl from it, and return the results.
+
+        If the crawl ran out of budget, the results so far come back with a
+        "budget" entry saying which limit stopped it.
+        """
         results_dict = {}
         if self.recursive_mode == "None":
             scraped = self.scrape_url(url)
-            if self.save_to_azure:
-                file_name = self.get_hostname(url) + '_' + str(uuid.uuid4()) + '.json'
-                self.azure_io_manager.upload_file(self.azure_container_name, self.azure_file_path, file_name, str(scraped))
+            self.save_result(url, scraped)
+            self.flush_results()
             results_dict.update(scraped)
-            return results_dict
+        else:
+            results_dict.update(self.iter_scrape(url))
+        if self.budget.exhausted():
+            results_dict["budget"] = self.budget_record(url)
+        return results_dict
+
+    def budget_record(self, seed):
+        """What the crawl from seed used of its budget, and which limit ran out."""
+        return {"seed": seed, **self.budget.record()}
+
+    def iter_scrape(self, url, frontier=None):
+        """Yield a (url, scraped) tuple for each page as soon as it is done.
+
+        Results aren't accumulated, so memory use stays flat however large
+        max_urls is. Saved results have all been uploaded once the iterator
+        is exhausted. The crawl also ends early once its budget runs out;
+        check self.budget afterwards to tell.
+
+        Args:
+            url: The url to start crawling from.
+            frontier: Frontier for a recursive crawl, seeded with url. Pass one
+                in to watch how many urls are still queued.
+        """
+        frontier = frontier if frontier is not None else self.new_frontier(url)
+        try:
+            yield from self.iter_crawl(url, frontier)
+        finally:
+            self.flush_results()
+            frontier.close()
+
+    def iter_crawl(self, url, frontier):
+        starting_domain = self.get_hostname(url)
+        if self.recursive_mode == "None":
+            scraped = self.scrape_url(url)
+            self.save_result(url, scraped)
+            yield url, scraped
         elif self.recursive_mode == "BFS":
-            queue = [url]
-            discovered = [url]
-
-            # TODO: clean this up
-            while queue and len(results_dict) < self.max_urls:
-                url = queue.pop(0)
-                if self.is_valid_url(url):
-                    scraped = self.scrape_url(url)                        
-                    if self.save_to_azure:
-                        file_name = self.get_hostname(url) + '_' + str(uuid.uuid4()) + '.json'
-                        self.azure_io_manager.upload_file(self.azure_container_name, self.azure_file_path, file_name, str({url: scraped}))
-                    results_dict.update({url: scraped})
-                    plugin = self.get_proper_handler(url)
-                    if hasattr(plugin, "get_links"):
-                        urls = plugin.get_links(url)
-                        for url in urls:
-                            if (
-                                url is not None
-                                and parse_url(url).hostname is not None
-                                and (
-                                    (
-                                        self.maintain_domain
-                                        and self.get_hostname(url)
-                                        == starting_domain
-                                    )
-                                    or self.maintain_domain == False
-                                )
-                                and url not in discovered
-                            ):
-                                queue.append(url)
-                                discovered.append(url)
-
-            return results_dict
-
-
-# TODO: It's unclear why we need to mount volumes twice. Can we do it once in the stub definition?
-@stub.function(
-    mounts=[modal.Mount(local_dir="./plugins", remote_dir="/root/plugins")],
-    secrets=[modal.Secret.from_name("openai-secret"), modal.Secret.from_name("azure-beatnik-storage-connection-string")],
-)
-def scrape_url(url, recursive_mode, maintain_domain, max_urls, save_to_azure, azure_container_name, run_id):
+            # frontier.done includes the pages done before a resumed crawl
+            # stopped, and those done by the other shards of a distributed one
+            while frontier and frontier.done < self.max_urls and not self.budget.exhausted():
+                url = frontier.pop()
+                if self.is_valid_url(url) and self.scheduler.allowed(url):
+                    with self.scheduler.slot(url):
+                        scraped, links = self.crawl_page(url)
+                    self.enqueue_links(frontier, url, links, starting_domain)
+                    yield url, scraped
+                    frontier.mark_done(url)
+                else:
+                    frontier.mark_done(url, counted=False)
+        elif self.recursive_mode in ("ConcurrentBFS", "BestFirst"):
+            # the crawl runs its own event loop on a background thread and
+            # hands finished pages over through a bounded queue, so workers
+            # wait for a slow consumer. Closing this generator stops the crawl.
+            results = queue.Queue(maxsize=self.num_workers)
+            stop = threading.Event()
+            finished = object()
+            errors = []
+
+            def hand_over(url, scraped):
+                # as in "BFS" mode, a page is only done once the consumer has
+                # dealt with it and asked for the next one
+                consumed = threading.Event()
+                if not put_until_stopped(results, (url, scraped, consumed), stop):
+                    return False
+                while not stop.is_set():
+                    if consumed.wait(0.5):
+                        return True
+                return consumed.is_set()
+
+            def run():
+                try:
+                    asyncio.run(self.scrape_concurrent(url, hand_over, frontier, stop))
+                except Exception as e:
+                    errors.append(e)
+                finally:
+                    put_until_stopped(results, finished, stop)
+
+            thread = threading.Thread(target=run, daemon=True)
+            thread.start()
+            try:
+                while (result := results.get()) is not finished:
+                    url, scraped, consumed = result
+                    yield url, scraped
+                    consumed.set()
+            finally:
+                # let the pages in flight wind down before the frontier is closed
+                stop.set()
+                thread.join()
+            if errors:
+                raise errors[0]
+
+    def iter_crawl_shard(self, seeds, frontier):
+        """Crawl one shard of a distributed crawl, yielding (url, scraped) for each page.
+
+        The crawl runs in rounds: this shard's queued urls are crawled with
+        recursive_mode, then links are exchanged with the other shards, until
+        every live shard is idle with no links left in flight or the run has
+        crawled max_urls pages between all its shards. With maintain_domain,
+        links are followed to any of the seeds' hosts. A shard whose budget
+        has run out stays idle, but keeps taking in the other shards' links so
+        they can tell when the crawl is over.
+
+        Args:
+            seeds: Every seed of the run; only those this shard owns are crawled here.
+            frontier: This worker's ShardFrontier.
+        """
+        self.seed_domains = {self.get_hostname(seed) for seed in seeds}
+        for seed in seeds:
+            if frontier.owns(seed):
+                frontier.add(seed)
+        frontier.start_heartbeat()
+        try:
+            while True:
+                arrived = frontier.sync()
+                if frontier.done >= self.max_urls:
+                    break
+                if frontier and not self.budget.exhausted():
+                    frontier.set_idle(False)
+                    yield from self.iter_crawl(frontier.peek(), frontier)
+                    continue
+                frontier.set_idle(True)
+                if not arrived and frontier.finished():
+                    break
+                time.sleep(frontier.poll_interval)
+        finally:
+            frontier.set_idle(True)
+            frontier.close()
+            self.flush_results()
+
+    async def scrape_concurrent(self, url, on_result, frontier, stop=None):
+        """Crawl with `num_workers` pages in flight at once.
+
+        Plugins are blocking, so each page is crawled on a thread pool while the
+        workers share a single frontier: breadth-first, or best-first if it is a
+        PriorityFrontier. `maintain_domain` and `max_urls` behave exactly as in
+        "BFS" mode, but pages finish in whatever order the network returns
+        them. Workers skip over urls whose host is being rate limited by the
+        scheduler, so one slow host doesn't hold up the others. A page's
+        links are queued before it is processed, so other workers can fetch
+        them while this one waits on the summarizer. Once the budget runs out
+        no more pages are started; those in flight are cut short, as their
+        downloads and summaries check the budget too, and then the crawl ends.
+
+        Args:
+            url: The url to start crawling from.
+            on_result: Called with (url, scraped) for each page as it finishes,
+                on a worker thread; it may block to hold the crawl back. It
+                returns whether the page was delivered; only delivered pages
+                are marked done, so a checkpointed crawl stopped before then
+                crawls them again when it resumes.
+            frontier: Frontier seeded with url.
+            stop: A threading.Event; once it is set no more pages are started.
+        """
+        starting_domain = self.get_hostname(url)
+        loop = asyncio.get_running_loop()
+        changed = asyncio.Condition()
+        in_flight = 0
+
+        def claimed():
+            # pages in flight or done, including those done before a resumed
+            # crawl stopped and by the other shards of a distributed one
+            return frontier.done + in_flight
+
+        def ready(url):
+            # invalid urls are popped so they can be dropped
+            return not self.is_valid_url(url) or self.scheduler.try_acquire(url)
+
+        async def next_url():
+            nonlocal in_flight
+            async with changed:
+                while True:
+                    exhausted = self.budget.exhausted()
+                    if stop is not None and stop.is_set():
+                        return None
+                    if in_flight == 0 and (claimed() >= self.max_urls or not frontier or exhausted):
+                        return None
+                    url = None
+                    if claimed() < self.max_urls and not exhausted:
+                        url = frontier.pop_first(ready)
+                    if url is None:
+                        try:
+                            await asyncio.wait_for(changed.wait(), self.scheduler.next_delay())
+                        except asyncio.TimeoutError:
+                            pass
+                    elif self.is_valid_url(url):
+                        in_flight += 1
+                        return url
+                    else:
+                        frontier.mark_done(url, counted=False)
+
+        async def worker(executor):
+            nonlocal in_flight
+            while True:
+                url = await next_url()
+                if url is None:
+                    async with changed:
+                        changed.notify_all()
+                    return
+                allowed = False
+                delivered = False
+                scraped = {}
+                try:
+                    allowed = await loop.run_in_executor(executor, self.scheduler.allowed, url)
+                    if allowed:
+                        fetched = FetchResult(url)
+                        links = await loop.run_in_executor(executor, self.get_page_links, url, fetched)
+                        async with changed:
+                            self.enqueue_links(frontier, url, links, starting_domain, fetched)
+                            changed.notify_all()
+                        scraped = await loop.run_in_executor(executor, self.scrape_url, url, fetched)
+                        await loop.run_in_executor(executor, self.save_result, url, scraped)
+                except Exception as e:
+                    print(e)
+                if allowed:
+                    delivered = await loop.run_in_executor(executor, on_result, url, scraped)
+                async with changed:
+                    self.scheduler.release(url)
+                    in_flight -= 1
+                    if not allowed:
+                        frontier.mark_done(url, counted=False)
+                    elif delivered:
+                        frontier.mark_done(url)
+                    changed.notify_all()
+
+        with ThreadPoolExecutor(max_workers=self.num_workers) as executor:
+            await asyncio.gather(*(worker(executor) for _ in range(self.num_workers)))
+
+
+def put_until_stopped(items, item, stop) -> bool:
+    """Put item on a bounded queue, waiting for room until stop is set.
+
+    Returns:
+        False if stop was set first and the item was dropped.
+    """
+    while not stop.is_set():
+        try:
+            items.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def new_run_id():
+    return str(datetime.now()).replace(' ', '_')
+
+
+# local result sinks write to {RESULTS_DIR}/{run_id}/
+RESULTS_DIR = os.environ.get("BEATNIK_RESULTS_DIR", "./results")
+
+
+def create_sink(sink, save_to_azure, azure_container_name, run_id):
+    """The ResultSink for a sink name; None picks Azure if save_to_azure is set."""
+    if sink is None:
+        sink = "azure" if save_to_azure else "none"
+    if sink == "azure":
+        return AzureIOManager.shared().result_writer(azure_container_name, run_id + '/successes')
+    elif sink == "jsonl":
+        return JsonlSink(os.path.join(RESULTS_DIR, run_id))
+    elif sink == "parquet":
+        return ParquetSink(os.path.join(RESULTS_DIR, run_id))
+    elif sink == "none":
+        return None
+    raise ValueError(f"Unknown sink {sink}")
+
+
+# checkpointed crawls keep their frontiers in {CHECKPOINT_DIR}/{run_id}/,
+# which is on the persisted cache volume on Modal
+CHECKPOINT_DIR = os.environ.get("BEATNIK_CHECKPOINT_DIR", os.path.join(CACHE_DIR, "checkpoints"))
+
+
+def build_scraper(recursive_mode, maintain_domain, max_urls, save_to_azure, azure_container_name, run_id, plugins=None, **scraper_options):
+    """A BeatnikScraper for one call, from the ScraperOptions fields passed to a Modal function."""
+    options = ScraperOptions(**scraper_options)
     if save_to_azure:
         azure_file_path = run_id + '/successes'
     else:
         azure_file_path = None
 
-    BS = BeatnikScraper(
+    return BeatnikScraper(
         plugin_dir="./plugins",
         recursive_mode=recursive_mode,
         maintain_domain=maintain_domain,
@@ -191,11 +680,151 @@ def scrape_url(url, recursive_mode, maintain_domain, max_urls, save_to_azure, az
         save_to_azure=save_to_azure,
         azure_container_name=azure_container_name,
         azure_file_path=azure_file_path,
+        options=options,
+        sink=create_sink(options.sink, save_to_azure, azure_container_name, run_id),
+        plugins=plugins,
+        checkpoint_dir=os.path.join(CHECKPOINT_DIR, run_id) if options.checkpoint else None,
     )
-    results = BS.scrape(url)
-    return results
 
-class ScrapeRequest(BaseModel):
+
+class Scraper:
+    """Modal functions that scrape urls, reusing one container's state across calls.
+
+    Modal calls __enter__ once when a container starts and __exit__ when it
+    stops, so the plugins, the Azure and HTTP clients and the browser and
+    process pools are set up once and shared by every call the container
+    serves. Only the BeatnikScraper (options, scheduler, sink) and each url's
+    FetchResult are per call. scrape_url keeps a warm container so calls
+    rarely wait on a cold start.
+    """
+
+    def __enter__(self):
+        self.plugins = PluginSet.shared("./plugins")
+        if os.environ.get("CONNECTION_STRING"):
+            AzureIOManager.shared()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        browser_pool.close()
+        http_client.close()
+        print("extraction process pool:", process_pool.metrics())
+        process_pool.close()
+
+    # TODO: It's unclear why we need to mount volumes twice. Can we do it once in the stub definition?
+    @stub.function(
+        mounts=local_mounts,
+        shared_volumes=fetch_cache_volumes,
+        secrets=[modal.Secret.from_name("openai-secret"), modal.Secret.from_name("azure-beatnik-storage-connection-string")],
+        keep_warm=True,
+    )
+    def scrape_url(self, url, recursive_mode, maintain_domain, max_urls, save_to_azure, azure_container_name, run_id, job_seed_index=None, **scraper_options):
+        """Scrape a url and return its results.
+
+        When job_seed_index is given, the url is seed number job_seed_index of the
+        crawl job run_id; progress and results are recorded in the job store as
+        each page finishes instead of being returned.
+        """
+        BS = build_scraper(recursive_mode, maintain_domain, max_urls, save_to_azure, azure_container_name, run_id, plugins=self.plugins, **scraper_options)
+        if job_seed_index is None:
+            results = BS.scrape(url)
+            return results
+
+        jobs = JobStore(stub.app.jobs)
+        jobs.start_seed(run_id, job_seed_index)
+        # a resumed seed crawls again the pages in flight when it stopped, or
+        # every page without a checkpoint; those already recorded are skipped
+        recorded = jobs.recorded_urls(run_id, job_seed_index)
+        frontier = BS.new_frontier(url)
+        try:
+            for page_url, scraped in BS.iter_scrape(url, frontier):
+                if page_url not in recorded:
+                    jobs.record_page(run_id, job_seed_index, page_url, scraped, queued=len(frontier))
+        except Exception as e:
+            print(e)
+            jobs.finish_seed(run_id, job_seed_index, error=e)
+            if save_to_azure:
+                save_failure.call(azure_container_name=azure_container_name, file_path=run_id + '/failures', file_name=str(uuid.uuid4()) + '.json', text=str(e))
+        else:
+            budget = BS.budget_record(url) if BS.budget.exhausted() else None
+            checkpoint_path = frontier.path if isinstance(frontier, CheckpointFrontier) else None
+            jobs.finish_seed(run_id, job_seed_index, budget=budget, checkpoint_path=checkpoint_path)
+
+    @stub.function(
+        mounts=local_mounts,
+        shared_volumes=fetch_cache_volumes,
+        secrets=[modal.Secret.from_name("openai-secret"), modal.Secret.from_name("azure-beatnik-storage-connection-string")],
+    )
+    def crawl_shard(self, shard, num_shards, urls, recursive_mode, maintain_domain, max_urls, save_to_azure, azure_container_name, run_id, **scraper_options):
+        """Crawl shard number `shard` of a distributed crawl of urls and return its results.
+
+        max_urls is the page budget of the whole run, shared by all shards.
+        """
+        BS = build_scraper(recursive_mode, maintain_domain, max_urls, save_to_azure, azure_container_name, run_id, plugins=self.plugins, **scraper_options)
+        frontier = ShardFrontier(stub.app.crawls, run_id, shard, num_shards, visited=BS.new_visited_set())
+        results = dict(BS.iter_crawl_shard(urls, frontier))
+        if BS.budget.exhausted():
+            results["budget"] = {"shard": shard, **BS.budget.record()}
+        return results
+
+    @stub.generator(
+        mounts=local_mounts,
+        shared_volumes=fetch_cache_volumes,
+        secrets=[modal.Secret.from_name("openai-secret"), modal.Secret.from_name("azure-beatnik-storage-connection-string")],
+    )
+    def scrape_url_stream(self, url, recursive_mode, maintain_domain, max_urls, save_to_azure, azure_container_name, run_id, **scraper_options):
+        """Like scrape_url, but yields a (url, scraped) tuple as soon as each page is done.
+
+        If the crawl ran out of budget, a final (None, budget record) tuple follows.
+        """
+        BS = build_scraper(recursive_mode, maintain_domain, max_urls, save_to_azure, azure_container_name, run_id, plugins=self.plugins, **scraper_options)
+        yield from BS.iter_scrape(url)
+        if BS.budget.exhausted():
+            yield None, BS.budget_record(url)
+
+
+class ScraperOptions(BaseModel):
+    num_workers: conint(ge=1, le=64) = 8 # only used by recursive_modes "ConcurrentBFS" and "BestFirst"
+    respect_robots: bool = True
+    per_host_rate: confloat(gt=0) = 2.0 # pages started per second per host
+    per_host_concurrency: conint(ge=1) = 4 # pages in flight per host
+    # where results are written; by default Azure if save_to_azure is set
+    sink: Optional[Literal["azure", "jsonl", "parquet", "none"]] = None
+    # "bloom" bounds the memory used to remember crawled urls, but may skip a few pages
+    visited_set: Literal["exact", "bloom"] = "exact"
+    # urls a "bloom" visited set is sized for; 100 million take about 180MB
+    visited_capacity: conint(ge=1, le=100_000_000) = 1_000_000
+    # checkpoint recursive crawls so POST /jobs/{job_id}/resume can pick them up;
+    # not supported with "BestFirst"
+    checkpoint: bool = False
+    # "BestFirst" only: how many links away from the seed to crawl, and words
+    # in a link's text or url that make it worth crawling sooner
+    max_depth: Optional[int] = None
+    link_keywords: List[str] = []
+    # per crawl budgets; a crawl that runs out stops early and returns what it has,
+    # with a "budget" record of which limit ran out
+    deadline: Optional[float] = None # seconds
+    max_bytes: Optional[int] = None # downloaded or rendered
+    max_llm_tokens: Optional[int] = None # prompt plus longest possible completion
+
+    def scraper_options(self) -> dict:
+        """The options passed through to BeatnikScraper."""
+        return {name: getattr(self, name) for name in ScraperOptions.__fields__}
+
+
+def reject_unsupported_options(request):
+    """Raise a 400 for options a crawl would otherwise silently ignore.
+
+    "BestFirst" crawls need a PriorityFrontier, and neither checkpointed nor
+    distributed crawls have one, so they would fall back to breadth-first.
+    """
+    if request.recursive_mode != "BestFirst":
+        return
+    if request.checkpoint:
+        raise HTTPException(status_code=400, detail='checkpoint is not supported with recursive_mode "BestFirst"')
+    if getattr(request, "distributed", False):
+        raise HTTPException(status_code=400, detail='distributed is not supported with recursive_mode "BestFirst"')
+
+
+class ScrapeRequest(ScraperOptions):
     url: str
     recursive_mode: str
     maintain_domain: bool
@@ -206,8 +835,9 @@ class ScrapeRequest(BaseModel):
 
 @app.post("/analyze")
 def analyze(request: ScrapeRequest) -> dict:
-    run_id = str(datetime.now()).replace(' ', '_')
-    results = scrape_url.call(
+    reject_unsupported_options(request)
+    run_id = new_run_id()
+    results = Scraper().scrape_url.call(
         url=request.url,
         recursive_mode=request.recursive_mode,
         maintain_domain=request.maintain_domain,
@@ -215,44 +845,284 @@ def analyze(request: ScrapeRequest) -> dict:
         save_to_azure=request.save_to_azure,
         azure_container_name=request.azure_container_name,
         run_id=run_id,
+        **request.scraper_options(),
     )
     return results
 
 
-class MultiScrapeRequest(BaseModel):
+class MultiScrapeRequest(ScraperOptions):
     urls: list
     recursive_mode: str
     maintain_domain: bool
     max_urls: int # in this case, this is the max number of urls per url
     save_to_azure: bool
     azure_container_name: str
+    # crawl all seeds as one run, split by host across num_shards workers, so
+    # pages linked from several seeds are only scraped once; not supported
+    # with "BestFirst"
+    distributed: bool = False
+    num_shards: conint(ge=1, le=64) = 4
 
 @stub.function(
+    mounts=local_mounts,
     secrets=[modal.Secret.from_name("openai-secret"), modal.Secret.from_name("azure-beatnik-storage-connection-string")],
 )
 def save_failure(azure_container_name, file_path, file_name, text):
-    FailureIOManager = AzureIOManager(os.environ.get("CONNECTION_STRING"))
+    FailureIOManager = AzureIOManager.shared()
     FailureIOManager.upload_file(azure_container_name, file_path, file_name, text)
 
 @app.post("/analyze-many")
 def analyze_many(request: MultiScrapeRequest) -> dict:
-    run_id = str(datetime.now()).replace(' ', '_')
+    reject_unsupported_options(request)
+    run_id = new_run_id()
+    if request.distributed and request.recursive_mode != "None":
+        return analyze_many_distributed(request, run_id)
     results = {}
-    for result in scrape_url.map(request.urls, kwargs={
+    budgets = []
+    for result in Scraper().scrape_url.map(request.urls, kwargs={
         "recursive_mode": request.recursive_mode,
         "maintain_domain": request.maintain_domain,
         "max_urls": request.max_urls,
         "save_to_azure": request.save_to_azure,
         "azure_container_name": request.azure_container_name,
         "run_id": run_id,
+        **request.scraper_options(),
     }, return_exceptions=True):
         if isinstance(result, Exception):
             file_path = run_id + '/failures'
             save_failure.call(azure_container_name=request.azure_container_name, file_path=file_path, file_name=str(uuid.uuid4()) + '.json', text=str(result))
         else:
+            collect_budget(result, budgets)
             results.update(result)
+    if budgets:
+        results["budgets"] = budgets
     return results
 
+
+def collect_budget(result, budgets):
+    """Move a seed's or shard's "budget" record out of its results into budgets."""
+    if "budget" in result:
+        budgets.append(result.pop("budget"))
+
+
+def analyze_many_distributed(request: MultiScrapeRequest, run_id) -> dict:
+    """Crawl all seeds as one run over request.num_shards workers.
+
+    Every worker owns the hosts that hash to it, so each page is scraped once
+    however many seeds link to it, and per-host rate limits hold for the
+    whole run. The run crawls about max_urls pages per seed in total; shards
+    see each other's page counts a little late, so it can overshoot slightly.
+    Budgets apply to each shard on its own.
+    """
+    results = {}
+    budgets = []
+    for result in Scraper().crawl_shard.map(range(request.num_shards), kwargs={
+        "num_shards": request.num_shards,
+        "urls": request.urls,
+        "recursive_mode": request.recursive_mode,
+        "maintain_domain": request.maintain_domain,
+        "max_urls": request.max_urls * len(request.urls),
+        "save_to_azure": request.save_to_azure,
+        "azure_container_name": request.azure_container_name,
+        "run_id": run_id,
+        **request.scraper_options(),
+    }, return_exceptions=True):
+        if isinstance(result, Exception):
+            file_path = run_id + '/failures'
+            save_failure.call(azure_container_name=request.azure_container_name, file_path=file_path, file_name=str(uuid.uuid4()) + '.json', text=str(result))
+        else:
+            collect_budget(result, budgets)
+            results.update(result)
+    delete_run(stub.app.crawls, run_id, request.num_shards)
+    if budgets:
+        results["budgets"] = budgets
+    return results
+
+
+STREAM_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream",
+}
+
+
+def format_record(event, record, stream_format):
+    """Serialize one streamed record as an NDJSON line or a Server-Sent Event."""
+    data = json.dumps(record, default=json_default)
+    if stream_format == "sse":
+        return f"event: {event}\ndata: {data}\n\n"
+    return data + "\n"
+
+
+def streaming_response(records, stream_format):
+    if stream_format not in STREAM_MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail=f"format must be one of {list(STREAM_MEDIA_TYPES)}")
+    return StreamingResponse(
+        (format_record(event, record, stream_format) for event, record in records),
+        media_type=STREAM_MEDIA_TYPES[stream_format],
+    )
+
+
+@app.post("/analyze/stream")
+def analyze_stream(request: ScrapeRequest, format: str = "ndjson"):
+    """Streaming /analyze: one {"url", "result"} record per page as soon as it is done.
+
+    A crawl that runs out of budget ends with a "budget" record.
+    """
+    reject_unsupported_options(request)
+    run_id = new_run_id()
+
+    def records():
+        for url, scraped in Scraper().scrape_url_stream.call(
+            url=request.url,
+            recursive_mode=request.recursive_mode,
+            maintain_domain=request.maintain_domain,
+            max_urls=request.max_urls,
+            save_to_azure=request.save_to_azure,
+            azure_container_name=request.azure_container_name,
+            run_id=run_id,
+            **request.scraper_options(),
+        ):
+            if url is None:
+                yield "budget", scraped
+            else:
+                yield "page", {"url": url, "result": scraped}
+
+    return streaming_response(records(), format)
+
+
+@app.post("/analyze-many/stream")
+def analyze_many_stream(request: MultiScrapeRequest, format: str = "ndjson"):
+    """Streaming /analyze-many: pages from all seeds are interleaved as they finish.
+
+    Each record is {"seed", "url", "result"}, {"seed", "error"} if a seed's
+    crawl failed, or a "budget" record if it ran out of budget.
+    """
+    reject_unsupported_options(request)
+    run_id = new_run_id()
+    # bounded, so seeds wait for a slow client; set once the client is gone
+    pending = queue.Queue(maxsize=len(request.urls))
+    stop = threading.Event()
+    seed_done = object()
+
+    def crawl_seed(seed):
+        try:
+            for url, scraped in Scraper().scrape_url_stream.call(
+                url=seed,
+                recursive_mode=request.recursive_mode,
+                maintain_domain=request.maintain_domain,
+                max_urls=request.max_urls,
+                save_to_azure=request.save_to_azure,
+                azure_container_name=request.azure_container_name,
+                run_id=run_id,
+                **request.scraper_options(),
+            ):
+                if url is None:
+                    record = ("budget", scraped)
+                else:
+                    record = ("page", {"seed": seed, "url": url, "result": scraped})
+                if not put_until_stopped(pending, record, stop):
+                    break
+        except Exception as e:
+            file_path = run_id + '/failures'
+            save_failure.call(azure_container_name=request.azure_container_name, file_path=file_path, file_name=str(uuid.uuid4()) + '.json', text=str(e))
+            put_until_stopped(pending, ("error", {"seed": seed, "error": str(e)}), stop)
+        finally:
+            put_until_stopped(pending, seed_done, stop)
+
+    def records():
+        for seed in request.urls:
+            threading.Thread(target=crawl_seed, args=(seed,), daemon=True).start()
+        remaining = len(request.urls)
+        try:
+            while remaining:
+                record = pending.get()
+                if record is seed_done:
+                    remaining -= 1
+                else:
+                    yield record
+        finally:
+            stop.set()
+
+    return streaming_response(records(), format)
+
+@app.post("/jobs")
+def submit_job(request: MultiScrapeRequest) -> dict:
+    """Start crawling request.urls in the background and return the job id right away.
+
+    The job id is the run id, so Azure uploads for the job are stored under it
+    as well. Poll GET /jobs/{job_id} for progress and read what has been
+    scraped so far with GET /jobs/{job_id}/results, following its cursor.
+    """
+    reject_unsupported_options(request)
+    job_id = new_run_id()
+    JobStore(stub.app.jobs).create(job_id, request.urls, request=request.dict())
+    for seed_index, seed in enumerate(request.urls):
+        spawn_job_seed(job_id, seed_index, request)
+    return {"job_id": job_id}
+
+
+def spawn_job_seed(job_id, seed_index, request: MultiScrapeRequest):
+    Scraper().scrape_url.spawn(
+        url=request.urls[seed_index],
+        recursive_mode=request.recursive_mode,
+        maintain_domain=request.maintain_domain,
+        max_urls=request.max_urls,
+        save_to_azure=request.save_to_azure,
+        azure_container_name=request.azure_container_name,
+        run_id=job_id,
+        job_seed_index=seed_index,
+        **request.scraper_options(),
+    )
+
+
+def get_job_store(job_id):
+    jobs = JobStore(stub.app.jobs)
+    if not jobs.exists(job_id):
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}")
+    return jobs
+
+
+@app.post("/jobs/{job_id}/resume")
+def resume_job(job_id: str) -> dict:
+    """Restart the seeds of a job that failed or whose container died.
+
+    Seeds of jobs submitted with "checkpoint": true continue from their last
+    checkpoint; others start over, skipping pages already recorded. Seeds
+    still running are left alone, as two containers must not crawl the same
+    seed at once; if all the unfinished seeds are, the response is a 409.
+    """
+    jobs = get_job_store(job_id)
+    request = MultiScrapeRequest(**jobs.request(job_id))
+    resumed, live = jobs.resumable_seeds(job_id)
+    if live and not resumed:
+        raise HTTPException(status_code=409, detail=f"Job {job_id} is still running")
+    for seed_index in resumed:
+        jobs.resume_seed(job_id, seed_index)
+        spawn_job_seed(job_id, seed_index, request)
+    return {
+        "job_id": job_id,
+        "resumed": [request.urls[seed_index] for seed_index in resumed],
+        "running": [request.urls[seed_index] for seed_index in live],
+    }
+
+
+@app.get("/jobs/{job_id}")
+def job_status(job_id: str) -> dict:
+    return get_job_store(job_id).status(job_id)
+
+
+@app.get("/jobs/{job_id}/results")
+def job_results(job_id: str, cursor: Optional[str] = None, page_size: int = 20) -> dict:
+    """Results scraped since cursor; pass the returned cursor to get the next ones."""
+    if not 0 < page_size <= 100:
+        raise HTTPException(status_code=400, detail="page_size must be between 1 and 100")
+    jobs = get_job_store(job_id)
+    try:
+        return jobs.results(job_id, cursor, page_size)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 class UploadRequest(BaseModel):
     container_name: str
     file_path: str
@@ -260,11 +1130,11 @@ class UploadRequest(BaseModel):
     contents: str
 
 @stub.function(
-    mounts=[modal.Mount(local_dir="./plugins", remote_dir="/root/plugins")],
+    mounts=local_mounts,
     secrets=[modal.Secret.from_name("openai-secret"), modal.Secret.from_name("azure-beatnik-storage-connection-string")],
 )
 def upload_helper(container_name, file_path, file_name, contents):
-    AIM = AzureIOManager(connection_string=os.environ.get("CONNECTION_STRING"))
+    AIM = AzureIOManager.shared()
     AIM.upload_file(container_name, file_path, file_name, contents)
 
 @app.post("/test-upload")
@@ -280,20 +1150,15 @@ def test_upload(request: UploadRequest):
 # TODO: cleanup recursion code and integrate this cleanly
 @app.post("/links")
 def get_site_links(request: ScrapeRequest) -> dict:
-    BS = BeatnikScraper(
-        plugin_dir="./plugins",
-        recursive_mode=request.recursive_mode,
-        maintain_domain=request.maintain_domain,
-        max_urls=request.max_urls,
-    )
-    plugin = BS.get_proper_handler(request.url)
+    plugin = PluginSet.shared("./plugins").get_proper_handler(request.url)
     links = []
     if hasattr(plugin, "get_links"):
         links = plugin.get_links(request.url)
     return {"links": links}
 
 @stub.asgi(
-    mounts=[modal.Mount(local_dir="./plugins", remote_dir="/root/plugins")],
+    mounts=local_mounts,
+    shared_volumes=fetch_cache_volumes,
     secrets=[modal.Secret.from_name("openai-secret"), modal.Secret.from_name("azure-beatnik-storage-connection-string")],
 )
 def fastapi_app():
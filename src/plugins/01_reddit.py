@@ -1,5 +1,4 @@
 from urllib3.util import parse_url
-import newspaper
 from .utils import BasePlugin
 
 
@@ -11,7 +10,7 @@ class RedditPlugin(BasePlugin):
             "old.reddit.com",
         ]
 
-    def process(self, url) -> dict:
+    def process(self, url, fetched=None) -> dict:
         """Process Reddit.
 
         This process function will summarize:
@@ -24,6 +23,8 @@ class RedditPlugin(BasePlugin):
         """
         # if path is a reddit subreddit, get the top posts
         if "/r/" in url:
+            import newspaper
+
             feed = newspaper.build(url, memoize_articles=False)
             feed.download_articles()
             feed.parse_articles()
@@ -33,9 +34,9 @@ class RedditPlugin(BasePlugin):
             content = "\n".join(
                 [f"article_{i + 1}: {title}" for i, title in enumerate(titles)]
             )
-            summary_prompt = content + "\n\nSummarize the previous articles"
-
-            summary = self.summarizer(summary_prompt)
+            summary = self.summarize_long(
+                content, suffix="\n\nSummarize the previous articles"
+            )
 
             # summarize the summaries
             return {"content": content, "summary": summary, "raw_source": content}
@@ -10,11 +10,12 @@ Note:
 
 import time
 from urllib3.util import parse_url
-from youtube_transcript_api import YouTubeTranscriptApi
-from playwright.sync_api import sync_playwright
-from parsel import Selector
+from crawler.registry import normalize_hostname
 import json
 import re
+from .browser_pool import browser_pool
+from .fetch import FetchResult
+from .process_pool import process_pool
 from .utils import url_to_param_dict, BasePlugin
 
 # youtube paths and params:
@@ -31,9 +32,8 @@ class YoutubePlugin(BasePlugin):
             "youtube.com",
             "youtu.be",
         ]
-        self.page_source = None
 
-    def get_links(self, url):
+    def get_links(self, url, fetched=None):
         """Gets all urls from the given youtube page with youtube domain
 
         Args:
@@ -42,8 +42,11 @@ class YoutubePlugin(BasePlugin):
         Returns:
             links: a list of links"""
 
+        from parsel import Selector
+
         # us playwright to load videos/comments and get all href attributes --> turn it into a urllib obj
-        page_source = self.page_source or self.get_page_source(url)
+        fetched = fetched or FetchResult(url)
+        page_source = self.get_page_source(url, fetched)
         selector = Selector(page_source)
         links = [url for url in selector.css("a::attr(href)").getall()]
 
@@ -52,7 +55,7 @@ class YoutubePlugin(BasePlugin):
             {
                 "url": link,
                 # keep hostname if given, else use 'youtube.com'
-                "hostname": parse_url(link).hostname.lstrip("www.")
+                "hostname": normalize_hostname(parse_url(link).hostname)
                 if parse_url(link).hostname
                 else "youtube.com",
                 # split path into list if given, else use empty array
@@ -92,6 +95,8 @@ class YoutubePlugin(BasePlugin):
         return unique_links
 
     def get_transcript(self, video_id) -> str:
+        from youtube_transcript_api import YouTubeTranscriptApi
+
         transcript = {}
         transcript_text = ""
         try:
@@ -105,7 +110,7 @@ class YoutubePlugin(BasePlugin):
 
         return transcript_text
 
-    def process(self, url) -> dict:
+    def process(self, url, fetched=None) -> dict:
         """Process the given youtube page.
 
         Args:
@@ -124,13 +129,14 @@ class YoutubePlugin(BasePlugin):
             return self.process_watch(
                 url=url,
                 video_id=params["v"],
+                fetched=fetched,
             )
         elif path == "/playlist":
             return self.process_playlist(playlist_id=params["list"])
         elif path == "/channel" or path[1] == "@":
             return self.process_channel(url)
 
-    def process_watch(self, url: str, video_id: str) -> dict:
+    def process_watch(self, url: str, video_id: str, fetched: FetchResult = None) -> dict:
         """Process the /watch path for a single video.
 
         Args:
@@ -139,16 +145,15 @@ class YoutubePlugin(BasePlugin):
 
         transcript_text = self.get_transcript(video_id)
 
-        # Summarize the first 500 characters of the transcript
-        transcript_prompt = (
-            transcript_text[:100] + "\n\nSummarize the previous video transcript"
+        # Summarize the whole transcript, chunked if it's too long for one prompt
+        summary = self.summarize_long(
+            transcript_text, suffix="\n\nSummarize the previous video transcript"
         )
-        summary = self.summarizer(transcript_prompt)
 
         # todo get video title, description, tags, numViews, upload date, numLikes, comment list
         # https://serpapi.com/blog/scrape-youtube-video-page-with-python/
 
-        page_source = self.page_source or self.get_page_source(url)
+        page_source = self.get_page_source(url, fetched or FetchResult(url))
         data = self.scrape_all_data(page_source)
 
         return {
@@ -178,19 +183,13 @@ class YoutubePlugin(BasePlugin):
             "summary": summary,
         }
 
-    def get_page_source(self, url: str) -> str:
+    def get_page_source(self, url: str, fetched: FetchResult) -> str:
         """Scrolls page to load suggest videos and comments"""
-        start = time.time()
-        with sync_playwright() as playwright:
-            browser = playwright.chromium.launch(headless=True)
-            browser.new_context(
-                # lang="en",
-                user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/104.0.0.0 Safari/537.36",
-            )
-            page = browser.new_page()
-            page.set_viewport_size(viewport_size={"width": 1366, "height": 768})
-            end = time.time()
-            print("time to open playwright:", end - start)
+        # the page is only rendered once per fetch
+        if fetched.page_source is not None:
+            return fetched.page_source
+
+        def render(page):
             page.goto(url)
             page.wait_for_selector("ytd-app")
 
@@ -215,102 +214,119 @@ class YoutubePlugin(BasePlugin):
 
                 old_height = new_height
 
-            page_source = page.content()
-            browser.close()
+            return page.content()
+
+        page_source = browser_pool.run(
+            render,
+            # lang="en",
+            user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/104.0.0.0 Safari/537.36",
+            viewport={"width": 1366, "height": 768},
+        )
 
         # cache page source to prevent duplicate calls
-        self.page_source = page_source
+        fetched.page_source = page_source
         return page_source
 
     def scrape_all_data(self, page_source: str):
-        selector = Selector(page_source)
-        all_script_tags = selector.css("script").getall()
-
-        title = selector.css(".title .ytd-video-primary-info-renderer::text").get()
-
-        date = selector.css("#info-strings yt-formatted-string::text").get()
+        return process_pool.run(parse_video_page, page_source)
 
-        duration = selector.css(".ytp-time-duration::text").get()
 
-        # https://regex101.com/r/0JNma3/1
-        keywords = (
-            "".join(
-                re.findall(
-                    r'"keywords":\[(.*)\],"channelId":".*"', str(all_script_tags)
-                )
-            )
-            .replace('"', "")
-            .split(",")
-        )
+def parse_video_page(page_source: str) -> dict:
+    """Parse the details, comments and suggested videos out of a rendered video page.
 
-        # https://regex101.com/r/9VhH1s/1
-        thumbnail = re.findall(
-            r'\[{"url":"(\S+)","width":\d*,"height":\d*},', str(all_script_tags)
-        )[0].split('",')[0]
-
-        channel = {
-            # https://regex101.com/r/xFUzq5/1
-            "id": "".join(
-                re.findall(r'"channelId":"(.*)","isOwnerViewing"', str(all_script_tags))
-            ),
-            "name": selector.css("#channel-name a::text").get(),
-            "link": f'https://www.youtube.com{selector.css("#channel-name a::attr(href)").get()}',
-            "subscribers": selector.css("#owner-sub-count::text").get(),
-            "thumbnail": selector.css("#img::attr(src)").get(),
-        }
+    Runs on the process pool, as its selectors and regexes over every script
+    tag keep a core busy.
+    """
+    from parsel import Selector
 
-        description = selector.css(
-            ".ytd-expandable-video-description-body-renderer span:nth-child(1)::text"
-        ).get()
+    selector = Selector(page_source)
+    all_script_tags = selector.css("script").getall()
 
-        # https://regex101.com/r/onRk9j/1
-        category = "".join(
-            re.findall(r'"category":"(.*)","publishDate"', str(all_script_tags))
-        )
+    title = selector.css(".title .ytd-video-primary-info-renderer::text").get()
 
-        num_comments = selector.css("#count::text").get()
+    date = selector.css("#info-strings yt-formatted-string::text").get()
 
-        comments = []
+    duration = selector.css(".ytp-time-duration::text").get()
 
-        for comment in selector.css("#contents > ytd-comment-thread-renderer"):
-            comments.append(
-                {
-                    "author": comment.css("#author-text span::text").get().strip(),
-                    "link": f'https://www.youtube.com{comment.css("#author-text::attr(href)").get()}',
-                    "date": comment.css(".published-time-text a::text").get(),
-                    "likes": comment.css("#vote-count-middle::text").get().strip(),
-                    "comment": comment.css("#content-text::text").get(),
-                }
+    # https://regex101.com/r/0JNma3/1
+    keywords = (
+        "".join(
+            re.findall(
+                r'"keywords":\[(.*)\],"channelId":".*"', str(all_script_tags)
             )
+        )
+        .replace('"', "")
+        .split(",")
+    )
+
+    # https://regex101.com/r/9VhH1s/1
+    thumbnail = re.findall(
+        r'\[{"url":"(\S+)","width":\d*,"height":\d*},', str(all_script_tags)
+    )[0].split('",')[0]
+
+    channel = {
+        # https://regex101.com/r/xFUzq5/1
+        "id": "".join(
+            re.findall(r'"channelId":"(.*)","isOwnerViewing"', str(all_script_tags))
+        ),
+        "name": selector.css("#channel-name a::text").get(),
+        "link": f'https://www.youtube.com{selector.css("#channel-name a::attr(href)").get()}',
+        "subscribers": selector.css("#owner-sub-count::text").get(),
+        "thumbnail": selector.css("#img::attr(src)").get(),
+    }
+
+    description = selector.css(
+        ".ytd-expandable-video-description-body-renderer span:nth-child(1)::text"
+    ).get()
+
+    # https://regex101.com/r/onRk9j/1
+    category = "".join(
+        re.findall(r'"category":"(.*)","publishDate"', str(all_script_tags))
+    )
+
+    num_comments = selector.css("#count::text").get()
+
+    comments = []
+
+    for comment in selector.css("#contents > ytd-comment-thread-renderer"):
+        comments.append(
+            {
+                "author": comment.css("#author-text span::text").get().strip(),
+                "link": f'https://www.youtube.com{comment.css("#author-text::attr(href)").get()}',
+                "date": comment.css(".published-time-text a::text").get(),
+                "likes": comment.css("#vote-count-middle::text").get().strip(),
+                "comment": comment.css("#content-text::text").get(),
+            }
+        )
 
-        suggested_videos = []
-
-        for video in selector.css("ytd-compact-video-renderer"):
+    suggested_videos = []
 
-            suggested_videos.append(
-                {
-                    "title": video.css("#video-title::text").get().strip(),
-                    "link": f'https://www.youtube.com{video.css("#thumbnail::attr(href)").get()}',
-                    # "channel_name": video.css("#channel-name #text::text").get(),
-                    #     "date": video.css("#metadata-line span:nth-child(2)::text").get(),
-                    #     "views": video.css("#metadata-line span:nth-child(1)::text").get(),
-                    #     "duration": video.css("#overlays #text::text").get().strip(),
-                    #     "thumbnail": video.css("#thumbnail img::attr(src)").get(),
-                }
-            )
+    for video in selector.css("ytd-compact-video-renderer"):
 
-        data = {
-            "title": title,
-            "date": date,
-            "duration": duration,
-            "channel": channel,
-            "keywords": keywords,
-            "thumbnail": thumbnail,
-            "description": description,
-            "category": category,
-            "suggested_videos": suggested_videos,
-            "num_comments": num_comments,
-            "comments": comments,
-        }
+        suggested_videos.append(
+            {
+                "title": video.css("#video-title::text").get().strip(),
+                "link": f'https://www.youtube.com{video.css("#thumbnail::attr(href)").get()}',
+                # "channel_name": video.css("#channel-name #text::text").get(),
+                #     "date": video.css("#metadata-line span:nth-child(2)::text").get(),
+                #     "views": video.css("#metadata-line span:nth-child(1)::text").get(),
+                #     "duration": video.css("#overlays #text::text").get().strip(),
+                #     "thumbnail": video.css("#thumbnail img::attr(src)").get(),
+            }
+        )
 
-        return data
+    data = {
+        "title": title,
+        "date": date,
+        "duration": duration,
+        "channel": channel,
+        "keywords": keywords,
+        "thumbnail": thumbnail,
+        "description": description,
+        "category": category,
+        "suggested_videos": suggested_videos,
+        "num_comments": num_comments,
+        "comments": comments,
+    }
+
+    return data
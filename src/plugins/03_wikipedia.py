@@ -1,13 +1,14 @@
-import wikipedia
 from .utils import BasePlugin
 
 
 class WikipediaPlugin(BasePlugin):
     def __init__(self):
         self.name = "wikipedia"
-        self.supported_domains = ["wikipedia.com", "en.wikipedia.org", "wikipedia.org"]
+        # the wikipedia library reads the English site, so other languages
+        # are left to the default plugin
+        self.supported_domains = ["en.wikipedia.org"]
 
-    def process(self, url) -> dict:
+    def process(self, url, fetched=None) -> dict:
         """Process Wikipedia.
 
         This process function will summarize:
@@ -20,6 +21,8 @@ class WikipediaPlugin(BasePlugin):
         # Get the page title
         page_title = url.split("/")[-1]
 
+        import wikipedia
+
         # Get the page summary
         try:
             page_summary = wikipedia.summary(page_title)
@@ -29,7 +32,7 @@ class WikipediaPlugin(BasePlugin):
             print(e)
             return {"summary": "No summary found."}
 
-    def get_links(self, url) -> list:
+    def get_links(self, url, fetched=None) -> list:
         """Get links from the given URL.
 
         Args:
@@ -41,12 +44,16 @@ class WikipediaPlugin(BasePlugin):
         # Get the page title
         page_title = url.split("/")[-1]
 
+        import wikipedia
+
         # Get the page links
         try:
-            page_links = wikipedia.page(page_title).links
+            titles = wikipedia.page(page_title).links
             page_links = [
-                f"https://en.wikipedia.org/wiki/{link}" for link in page_links
+                f"https://en.wikipedia.org/wiki/{title}" for title in titles
             ]
+            if fetched is not None:
+                fetched.anchors = dict(zip(page_links, titles))
         except Exception as e:
             print(e)
             page_links = []
@@ -1,8 +1,9 @@
-import requests
 import re
+from .extraction import extract_pdf_links
+from .fetch import FetchResult
+from .fetch_cache import fetch_cache
 from .utils import BasePlugin
 from urllib3.util import parse_url
-import fitz
 
 
 class GoogledocsPlugin(BasePlugin):
@@ -10,7 +11,7 @@ class GoogledocsPlugin(BasePlugin):
         self.name = "googledocs"
         self.supported_domains = ["docs.google.com"]
 
-    def process(self, url) -> dict:
+    def process(self, url, fetched=None) -> dict:
         """Process Google Sheets.
 
         This process function will summarize:
@@ -25,27 +26,27 @@ class GoogledocsPlugin(BasePlugin):
         # TODO: add support for docs and presentations
         path = parse_url(url).path
         if path.startswith("/spreadsheets/d/"):
-            return self.process_sheets(url)
+            return self.process_sheets(url, fetched)
         elif path.startswith("/document/d/"):
             return {"summary": "No summary found. Docs not supported yet."}
         elif path.startswith("/presentation/d/"):
             return {"summary": "No summary found. Presentations not supported yet."}
 
     # TODO: use google sheets api to access formula instead of just value
-    def process_sheets(self, url):
+    def process_sheets(self, url, fetched=None):
         try:
-            csv_request = self.get_sheets_csv(url)
+            csv_text = self.get_sheets_csv(url, fetched)
         except Exception as e:
             print(e)
             return {"summary": "No summary found."}
 
-        if 'href="https://accounts.google.com/v3/signin/"' in csv_request.text:
+        if 'href="https://accounts.google.com/v3/signin/"' in csv_text:
             return {"summary": "Unauthorized to access google sheets."}
 
         # Get the page summary
-        return {"summary": csv_request.text, "raw_source": csv_request.text}
+        return {"summary": csv_text, "raw_source": csv_text}
 
-    def get_links(self, url) -> list:
+    def get_links(self, url, fetched=None) -> list:
         """Get links from the given URL.
 
         Args:
@@ -61,7 +62,7 @@ class GoogledocsPlugin(BasePlugin):
 
         # get sheet as csv to grab all text from cell values
         try:
-            csv_text = self.get_sheets_csv(url).text
+            csv_text = self.get_sheets_csv(url, fetched)
             for cell in csv_text.split(","):
                 csv_links.extend(re.findall(url_regex, cell))
         except Exception as e:
@@ -71,28 +72,26 @@ class GoogledocsPlugin(BasePlugin):
         # download document
         split_url = url.split("/")
         doc_id = split_url[split_url.index("d") + 1]
-        r = requests.get(
+        r = fetch_cache.get(
             f"https://docs.google.com/spreadsheets/d/{doc_id}/export?format=pdf"
         )
-        filename = "file.pdf"
-        open(filename, "wb+").write(r.content)
 
         # extract links from document using pymupdf
         pdf_links = []
         try:
-            pdf = fitz.open(filename)
-            for page in pdf:
-                link = page.first_link
-                while link:
-                    pdf_links.append(link.uri)
-                    link = link.next
+            pdf_links = extract_pdf_links(r.content)
         except Exception as e:
             print(e)
 
         # return union of both methods
         return set(csv_links) or set(pdf_links)
 
-    def get_sheets_csv(self, url):
+    def get_sheets_csv(self, url, fetched=None):
+        """Text of the sheet's csv export, downloaded once per fetch."""
+        fetched = fetched or FetchResult(url)
+        if fetched.text is not None:
+            return fetched.text
+
         # Get the DOCID from the url
         split_url = url.split("/")
         doc_id = split_url[split_url.index("d") + 1]
@@ -101,4 +100,9 @@ class GoogledocsPlugin(BasePlugin):
         request_url = (
             f"https://docs.google.com/spreadsheets/d/{doc_id}/export?format=csv"
         )
-        return requests.get(request_url)
+        r = fetch_cache.get(request_url)
+        fetched.status = r.status_code
+        fetched.headers = r.headers
+        fetched.content_type = r.headers.get("content-type")
+        fetched.text = r.text
+        return fetched.text
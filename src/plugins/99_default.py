@@ -10,14 +10,16 @@ Note:
 Hint:
     This plugin should always be the last plugin in the list of plugins.
 """
-from playwright.sync_api import sync_playwright
+from .browser_pool import browser_pool
+from .extraction import extract_html_text, extract_pdf, extract_text
+from .fetch import FetchResult
+from .fetch_cache import SNIFF_BYTES, ResponseTooLarge, fetch_cache
+from .process_pool import process_pool
+from .sniff import media_type, sniff_content_type
 from .utils import BasePlugin, document_extensions
-import textract
-import requests
+import os
 import re
 import mimetypes
-from newspaper import Article
-import fitz
 
 """
 This default plugin should handle most use cases, websites, and file formats
@@ -32,6 +34,10 @@ things to fix:
 """
 
 
+# documents larger than this are given up on rather than downloaded
+MAX_DOCUMENT_BYTES = int(os.environ.get("BEATNIK_MAX_DOCUMENT_BYTES", 100 * 1024**2))
+
+
 def supports_url(url: str) -> bool:
     """Check if the plugin supports the given URL.
 
@@ -46,84 +52,146 @@ class DefaultPlugin(BasePlugin):
         self.supported_domains = ["*"]
         self.document_extensions = document_extensions
         self.timeout = 5
-        self.page_source = None
-        self.links = None
-
-    def get_content_type(self, url):
-        content_type = None
-        try:
-            return requests.head(url, timeout=self.timeout).headers.get("content-type")
-        except Exception as e:
-            print(e)
+        self.max_document_bytes = MAX_DOCUMENT_BYTES
+
+    def get_content_type(self, url, fetched=None):
+        """The url's content type, found with a single streaming GET.
+
+        The type is sniffed from the first bytes of the body as well as the
+        content-type header, which is often missing or wrong. Documents we
+        can extract are downloaded whole in the same request, up to
+        max_document_bytes; for anything else, webpages included as the
+        browser renders those, the download stops after the first bytes.
+        """
+        fetched = fetched or FetchResult(url)
+        if fetched.headers is None:
+            try:
+                r = fetch_cache.get(
+                    url,
+                    timeout=self.timeout,
+                    max_bytes=self.max_document_bytes,
+                    accept=lambda headers, head: self.is_document(sniff_content_type(headers.get("content-type"), head, url)),
+                )
+                fetched.status = r.status_code
+                fetched.headers = r.headers
+                fetched.content_type = sniff_content_type(r.headers.get("content-type"), r.content[:SNIFF_BYTES], url)
+                if r.complete:
+                    fetched.body = r.content
+            except ResponseTooLarge as e:
+                print(e)
+                fetched.status = e.status_code
+                fetched.headers = e.headers
+                fetched.content_type = sniff_content_type(e.headers.get("content-type"), b"", url)
+                fetched.error = e
+            except Exception as e:
+                print(e)
+                fetched.headers = {}
+        return fetched.content_type
+
+    def document_extension(self, content_type):
+        """The file extension of a supported document type, or None."""
+        extension = mimetypes.guess_extension(media_type(content_type)) if content_type else None
+        if extension is None or extension.lstrip(".") not in self.document_extensions:
             return None
+        return extension
 
-    def process(self, url) -> dict:
+    def is_document(self, content_type) -> bool:
+        return self.document_extension(content_type) is not None
+
+    def get_document_extension(self, url, fetched):
+        """The document's file extension, or None if it isn't a supported document type."""
+        content_type = self.get_content_type(url, fetched)
+        extension = self.document_extension(content_type)
+        if extension is None:
+            print(content_type)
+        return extension
+
+    def download(self, url, fetched):
+        if fetched.error is not None:
+            raise fetched.error
+        if fetched.body is None:
+            r = fetch_cache.get(url, max_bytes=self.max_document_bytes)
+            fetched.status = r.status_code
+            fetched.body = r.content
+        return fetched.body
+
+    def process(self, url, fetched=None) -> dict:
         print("processing with default plugin:", url)
-        content_type = self.get_content_type(url)
+        fetched = fetched or FetchResult(url)
+        content_type = self.get_content_type(url, fetched)
 
         if content_type is None:
             return {"content": "Could not reach webpage in time"}
         # if it's a webpage use playwright to get html and then use textract
         elif "text/html" in content_type:
             print("- using website processing.")
-            return self.process_webpage(url)
+            return self.process_webpage(url, fetched)
         # if it's a document filetype, download it and use textract
         else:
             print("- using document processing.")
-            return self.process_document(url)
-
-    def process_document(self, url):
-        # download document
-        r = requests.get(url)
-        extension = mimetypes.guess_extension(self.get_content_type(url))
-        filename = f"file{extension}"
-        if extension is None:
-            print(self.get_content_type(url))
-            return {"content": "Document extension not supported"}
-        if extension.lstrip(".") not in self.document_extensions:
+            return self.process_document(url, fetched)
+
+    def extract_document_text(self, url, fetched):
+        """Download the document and extract its text, once per fetch.
+
+        PDFs are read natively with PyMuPDF, which gets their links in the same pass.
+        """
+        if fetched.text is None:
+            extension = self.get_document_extension(url, fetched)
+            if extension == ".pdf":
+                fetched.text, fetched.links = extract_pdf(self.download(url, fetched))
+            else:
+                fetched.text = process_pool.run(extract_text, self.download(url, fetched), extension)
+        return fetched.text
+
+    def process_document(self, url, fetched=None):
+        fetched = fetched or FetchResult(url)
+        if self.get_document_extension(url, fetched) is None:
             return {"content": "Document extension not supported"}
 
-        open(filename, "wb+").write(r.content)
-
         # extract text from document
         try:
-            content = textract.process(filename, output_encoding="utf-8").decode(
-                "utf-8"
-            )
-            # remove whitespace
-            content = " ".join(content.split())
+            content = self.extract_document_text(url, fetched)
+        except ResponseTooLarge as e:
+            print(e)
+            return {"content": "Document is too large to process"}
         except Exception as e:
             print(e)
             content = "Document could not be processed"
 
         return {
             "content": content,
-            "summary": self.summarizer(content),
+            "summary": self.summarize_long(content),
             "raw_source": content,
         }
 
-    def cache_webpage_data(self, url):
+    def cache_webpage_data(self, url, fetched):
+        """Render the page once per fetch, keeping its page source, links and their text."""
+        if fetched.page_source is not None:
+            return fetched.page_source, fetched.links
+
+        def render(page):
+            page.goto(url)
+            return page.content(), page.evaluate(
+                """() => [...document.querySelectorAll('a')].map(link => [link.href, link.innerText]);"""
+            )
+
+        page_source, anchors = None, []
         try:
-            with sync_playwright() as p:
-                browser = p.chromium.launch()
-                page = browser.new_page()
-                page.goto(url)
-                # cache page source and links
-                self.page_source = page.content()
-                self.links = page.evaluate(
-                    """() => [...document.querySelectorAll('a')].map(link => link.href);"""
-                )
-                browser.close()
+            page_source, anchors = browser_pool.run(render)
         except Exception as e:
             print(e)
             print("Webpage data could not be cached")
+        fetched.page_source = page_source
+        fetched.links = [href for href, _ in anchors]
+        fetched.anchors = {href: text for href, text in anchors if text}
+        return page_source, fetched.links
 
-    def process_webpage(self, url):
+    def process_webpage(self, url, fetched=None):
+        fetched = fetched or FetchResult(url)
         # use playwright to open and get html then process
-        try:
-            self.cache_webpage_data(url)
-        except Exception as e:
-            print(e)
+        page_source, _ = self.cache_webpage_data(url, fetched)
+        if page_source is None:
             return {
                 "content": "Webpage data could not be cached",
                 "raw_source": None,
@@ -131,12 +199,7 @@ class DefaultPlugin(BasePlugin):
 
         try:
             # process retrieved html
-            filename = "file.html"
-            open(filename, "w+").write(self.page_source)
-            content = textract.process(filename, output_encoding="utf-8")
-
-            # remove whitespace
-            content = " ".join(content.decode("utf-8").split())
+            content = process_pool.run(extract_html_text, page_source)
         except Exception as e:
             print(e)
             return {
@@ -144,60 +207,49 @@ class DefaultPlugin(BasePlugin):
                 "raw_source": None,
             }
 
-        summary = self.summarizer(
-            "summarize the following webpage content:\n" + content
+        summary = self.summarize_long(
+            content, prefix="summarize the following webpage content:\n"
         )
-        return {"raw_source": self.page_source, "content": content, "summary": summary}
+        return {"raw_source": page_source, "content": content, "summary": summary}
 
-    def get_links(self, url) -> list:
-        content_type = self.get_content_type(url)
+    def get_links(self, url, fetched=None) -> list:
+        fetched = fetched or FetchResult(url)
+        content_type = self.get_content_type(url, fetched)
 
-        if "text/html" in content_type:
+        if content_type is None:
+            return []
+        elif "text/html" in content_type:
             print("- getting webpage links")
-            self.links = self.get_webpage_links(url)
+            links = self.get_webpage_links(url, fetched)
         else:
             print("- getting document links")
-            self.links = self.get_document_links(url)
+            links = self.get_document_links(url, fetched)
 
         # remove empty urls, fragment identifiers, and mailtos
         links = {
             link
-            for link in self.links
+            for link in links
             if link != "" and "#" not in link and not link.startswith("mailto:")
         }
 
         return links
 
-    def get_webpage_links(self, url):
-        # cache the links first
-        self.cache_webpage_data(url)
-
-        return self.links
+    def get_webpage_links(self, url, fetched):
+        _, links = self.cache_webpage_data(url, fetched)
+        return links or []
 
-    def get_document_links(self, url):
-        # download document
-        r = requests.get(url)
-        extension = mimetypes.guess_extension(self.get_content_type(url))
-        
+    def get_document_links(self, url, fetched):
+        extension = self.get_document_extension(url, fetched)
         if extension is None:
-            print("can't get links: document type not supported")
-            print(self.get_content_type(url))
-            return []
-        if extension.lstrip(".") not in self.document_extensions:
             print("can't get links: document type not supported")
             return []
         # special processing for pdfs
         elif extension == ".pdf":
-            return self.get_pdf_links(url)
-
-        filename = f"file{extension}"
-        open(filename, "wb+").write(r.content)
+            return self.get_pdf_links(url, fetched)
 
         # extract text from document
         try:
-            content = textract.process(filename, output_encoding="utf-8").decode(
-                "utf-8"
-            )
+            content = self.extract_document_text(url, fetched)
         except Exception as e:
             print(e)
             content = ""
@@ -207,26 +259,10 @@ class DefaultPlugin(BasePlugin):
         links = re.findall(url_regex, content)
         return links
 
-    def get_pdf_links(self, url):
-        # download document
-        r = requests.get(url)
-        extension = mimetypes.guess_extension(self.get_content_type(url))
-        if extension.lstrip(".") not in self.document_extensions:
-            print("can't get links: document type not supported")
-            return []
-        filename = f"file{extension}"
-        open(filename, "wb+").write(r.content)
-
-        # extract links from document using pymupdf
-        links = []
+    def get_pdf_links(self, url, fetched):
+        # links come out of the same pass as the text
         try:
-            pdf = fitz.open(filename)
-            for page in pdf:
-                link = page.first_link
-                while link:
-                    links.append(link.uri)
-                    link = link.next
+            self.extract_document_text(url, fetched)
         except Exception as e:
             print(e)
-
-        return links
+        return fetched.links or []
@@ -0,0 +1,119 @@
+"""Shared Playwright browser pool.
+
+Plugins render pages through the module level `browser_pool` instead of
+launching their own Chromium for every url:
+
+    def render(page):
+        page.goto(url)
+        return page.content()
+
+    page_source = browser_pool.run(render)
+
+The sync Playwright API is bound to the thread that started it, so each pool
+worker is a thread that owns one long-lived browser. Every job gets a fresh,
+isolated browser context which is closed when the job finishes. A worker
+relaunches its browser after `pages_per_browser` jobs or when the browser has
+crashed. Jobs run while a crawl budget is in use are refused once it runs out
+and time out at its deadline.
+"""
+import atexit
+import queue
+import threading
+from concurrent.futures import Future
+
+from crawler.budget import current_budget
+
+
+class BrowserPool:
+    def __init__(self, size=4, pages_per_browser=50, headless=True):
+        self.size = size
+        self.pages_per_browser = pages_per_browser
+        self.headless = headless
+        self.jobs = queue.Queue()
+        self.workers = []
+        self.lock = threading.Lock()
+
+    def run(self, fn, **context_options):
+        """Call fn(page) on a new page of a pooled browser and return its result.
+
+        Args:
+            fn: Callable taking a Playwright page.
+            context_options: Keyword arguments for `browser.new_context`, e.g. user_agent.
+        """
+        budget = current_budget()
+        timeout = None
+        if budget is not None:
+            budget.check()
+            timeout = budget.remaining_time()
+        future = Future()
+        self.jobs.put((fn, context_options, timeout, future))
+        self.start_workers()
+        return future.result()
+
+    def start_workers(self):
+        with self.lock:
+            self.workers = [worker for worker in self.workers if worker.is_alive()]
+            while len(self.workers) < self.size:
+                worker = threading.Thread(target=self.work, daemon=True)
+                worker.start()
+                self.workers.append(worker)
+
+    def work(self):
+        playwright = None
+        browser = None
+        pages = 0
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            fn, context_options, timeout, future = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                if playwright is None:
+                    # imported here so plugins can be loaded without playwright's startup cost
+                    from playwright.sync_api import sync_playwright
+
+                    playwright = sync_playwright().start()
+                if browser is not None and (not browser.is_connected() or pages >= self.pages_per_browser):
+                    self.close_browser(browser)
+                    browser = None
+                if browser is None:
+                    browser = playwright.chromium.launch(headless=self.headless)
+                    pages = 0
+                pages += 1
+                context = browser.new_context(**context_options)
+                if timeout is not None:
+                    # Playwright treats a timeout of 0 as none at all
+                    context.set_default_timeout(max(timeout * 1000, 1))
+                try:
+                    page = context.new_page()
+                    future.set_result(fn(page))
+                finally:
+                    context.close()
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+        if browser is not None:
+            self.close_browser(browser)
+        if playwright is not None:
+            playwright.stop()
+
+    def close_browser(self, browser):
+        try:
+            browser.close()
+        except Exception as e:
+            print(e)
+
+    def close(self):
+        """Stop all workers and close their browsers."""
+        with self.lock:
+            workers, self.workers = self.workers, []
+        for _ in workers:
+            self.jobs.put(None)
+        for worker in workers:
+            worker.join()
+
+
+browser_pool = BrowserPool()
+atexit.register(browser_pool.close)
@@ -0,0 +1,143 @@
+"""Text and link extraction from downloaded documents.
+
+Everything here works on in-memory content rather than fixed filenames in
+the working directory, so several urls can be extracted at once in the same
+container. PDFs are opened by PyMuPDF straight from memory; textract only
+reads from disk, so its input goes to a unique temporary file which is
+removed afterwards. Both are imported on first use, as they are slow to
+import.
+
+Extraction is CPU bound, so plugins run it on the shared process pool,
+e.g. `process_pool.run(extract_text, content, extension)`; these functions
+are defined at module level so they can be sent to its workers. PDFs get
+their text and links from a single PyMuPDF pass, long ones split into page
+ranges that are extracted in parallel from one temporary copy of the file.
+"""
+import math
+import os
+import tempfile
+from contextlib import contextmanager
+
+from .process_pool import process_pool
+
+# PDFs are split across processes in ranges of at least this many pages
+PDF_PAGES_PER_PROCESS = 25
+
+
+@contextmanager
+def temporary_file(content: bytes, extension: str):
+    """Write content to a uniquely named temporary file and yield its path."""
+    fd, path = tempfile.mkstemp(prefix="beatnik-", suffix=extension)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(content)
+        yield path
+    finally:
+        os.remove(path)
+
+
+def normalize_whitespace(text: str) -> str:
+    return " ".join(text.split())
+
+
+def extract_text(content: bytes, extension: str) -> str:
+    """Extract text from a document with textract.
+
+    Args:
+        content: The raw document.
+        extension: The document's file extension including the dot, e.g. ".docx".
+            textract picks its parser by extension.
+
+    Returns:
+        The document text with whitespace normalized.
+    """
+    import textract
+
+    with temporary_file(content, extension) as path:
+        text = textract.process(path, output_encoding="utf-8").decode("utf-8")
+    return normalize_whitespace(text)
+
+
+def extract_html_text(page_source: str) -> str:
+    """Extract the text of an html page."""
+    return extract_text(page_source.encode("utf-8"), ".html")
+
+
+def extract_pdf_links(content: bytes) -> list:
+    """Extract the links embedded in a PDF."""
+    import fitz
+
+    links = []
+    with fitz.open(stream=content, filetype="pdf") as pdf:
+        for page in pdf:
+            link = page.first_link
+            while link:
+                links.append(link.uri)
+                link = link.next
+    return links
+
+
+def read_pdf_pages(pdf, start=0, stop=None) -> tuple:
+    texts = []
+    links = []
+    for page_number in range(start, pdf.page_count if stop is None else stop):
+        page = pdf[page_number]
+        texts.append(page.get_text())
+        # internal links, to other pages of the document, have no uri
+        links.extend(link["uri"] for link in page.get_links() if link.get("uri"))
+    return normalize_whitespace(" ".join(texts)), links
+
+
+def extract_pdf_pages(content: bytes, start=0, stop=None) -> tuple:
+    """Extract the text and links of pages start to stop of a PDF in one pass.
+
+    Returns:
+        A (text, links) tuple: the pages' text with whitespace normalized, and
+        the urls they link to.
+    """
+    import fitz
+
+    with fitz.open(stream=content, filetype="pdf") as pdf:
+        return read_pdf_pages(pdf, start, stop)
+
+
+def extract_pdf_file_pages(path: str, start=0, stop=None) -> tuple:
+    """Like extract_pdf_pages, for a PDF on disk.
+
+    Page range jobs get the path of a shared temporary file rather than the
+    PDF itself, so the document isn't pickled once per job.
+    """
+    import fitz
+
+    with fitz.open(path, filetype="pdf") as pdf:
+        return read_pdf_pages(pdf, start, stop)
+
+
+def extract_pdf(content: bytes) -> tuple:
+    """Extract the text and links of a PDF, reading it only once.
+
+    Runs on the process pool: PDFs of under 2 * PDF_PAGES_PER_PROCESS pages
+    as a single job, longer ones split into page ranges over its workers.
+
+    Returns:
+        A (text, links) tuple; the text has its whitespace normalized.
+    """
+    import fitz
+
+    with fitz.open(stream=content, filetype="pdf") as pdf:
+        page_count = pdf.page_count
+
+    if process_pool.processes <= 1 or page_count < 2 * PDF_PAGES_PER_PROCESS:
+        return process_pool.run(extract_pdf_pages, content)
+    pages_per_process = max(PDF_PAGES_PER_PROCESS, math.ceil(page_count / process_pool.processes))
+    ranges = [(start, min(start + pages_per_process, page_count)) for start in range(0, page_count, pages_per_process)]
+    texts, links = [], []
+    # the file must outlive every job that reads it
+    with temporary_file(content, ".pdf") as path:
+        futures = [process_pool.submit(extract_pdf_file_pages, path, start, stop) for start, stop in ranges]
+        for future in futures:
+            range_text, range_links = future.result()
+            if range_text:
+                texts.append(range_text)
+            links.extend(range_links)
+    return " ".join(texts), links
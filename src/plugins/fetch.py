@@ -0,0 +1,34 @@
+class FetchResult:
+    """Everything fetched for a single url while it is being crawled.
+
+    The scraper creates one FetchResult per url and passes it to both
+    `plugin.process` and `plugin.get_links`, so whatever one of them downloads
+    or renders is reused by the other instead of being fetched again. Fields
+    are None until a plugin has filled them in.
+
+    Attributes:
+        url: The url being crawled.
+        status: HTTP status code of the response.
+        headers: Response headers.
+        content_type: Value of the content-type header.
+        body: Raw response body as bytes.
+        page_source: DOM of the page after rendering it in a browser.
+        text: Text extracted from the body or page source.
+        links: Links found on the page.
+        anchors: Text of the links found on the page, by link url, for plugins
+            that know it.
+        error: Why the body couldn't be fetched, e.g. ResponseTooLarge, so
+            it isn't requested again.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.status = None
+        self.headers = None
+        self.content_type = None
+        self.body = None
+        self.page_source = None
+        self.text = None
+        self.links = None
+        self.anchors = None
+        self.error = None
@@ -0,0 +1,359 @@
+"""Persistent on-disk HTTP cache shared by all plugins.
+
+Responses are indexed in SQLite by normalized url and their bodies are
+stored content-addressed (by sha256) under `objects/`, so identical bodies
+served from several urls are only stored once. A cached response younger
+than `ttl` seconds is served without touching the network; an older one is
+revalidated with If-None-Match / If-Modified-Since and a 304 just refreshes
+it. When the stored bodies grow past `max_bytes` the least recently used
+entries are evicted.
+
+The cache is best-effort: it usually lives on a volume shared by many
+containers, so if the index is locked for longer than `busy_timeout` or the
+disk fails, the error is logged and the url is fetched as if it weren't
+cached.
+
+Plugins fetch through the module level `fetch_cache`:
+
+    r = fetch_cache.get(url)
+    r.content, r.text, r.headers, r.status_code, r.from_cache
+
+It is configured by BEATNIK_CACHE_DIR, BEATNIK_FETCH_CACHE_TTL (seconds,
+default an hour) and BEATNIK_FETCH_CACHE_MAX_BYTES (default 2GB).
+
+Bodies are streamed: pass max_bytes to give up on large downloads, or an
+accept callback to stop after the first bytes (see FetchCache.get).
+
+Requests made while a crawl budget is in use (crawler.budget.use_budget)
+are refused once it runs out and charge the bytes they download to it;
+a download is cut short as soon as the deadline passes or the bytes run
+out. Cache hits are free.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from urllib.parse import urlsplit, urlunsplit
+
+import httpx
+
+from crawler.budget import current_budget
+
+from .http_client import http_client
+
+CACHE_DIR = os.environ.get(
+    "BEATNIK_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "beatnik")
+)
+# seconds a response is served without revalidating it
+TTL = float(os.environ.get("BEATNIK_FETCH_CACHE_TTL", 3600))
+# stored bodies, after which the least recently used are evicted
+MAX_BYTES = int(os.environ.get("BEATNIK_FETCH_CACHE_MAX_BYTES", 2 * 1024**3))
+
+
+def normalize_url(url: str) -> str:
+    """Cache key for a url: lowercase scheme and host, no default port, no fragment."""
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or "").lower()
+    if parts.port and (scheme, parts.port) not in (("http", 80), ("https", 443)):
+        host = f"{host}:{parts.port}"
+    return urlunsplit((scheme, host, parts.path or "/", parts.query, ""))
+
+
+# how much of a body FetchCache.get's accept callback sees, enough for
+# magic numbers and the start of an html document
+SNIFF_BYTES = 2048
+
+
+class ResponseTooLarge(Exception):
+    """A response body was larger than the max_bytes it was fetched with."""
+
+    def __init__(self, url, response, size, max_bytes):
+        self.url = url
+        self.status_code = response.status_code
+        self.headers = httpx.Headers(response.headers)
+        self.size = size
+        self.max_bytes = max_bytes
+        size = f" {size} bytes," if size is not None else ""
+        super().__init__(f"{url} is{size} over the limit of {max_bytes} bytes")
+
+
+# errors from a locked or unreadable index or object store
+CACHE_ERRORS = (sqlite3.Error, OSError)
+
+# describe the bytes on the wire rather than the decoded body we store
+UNCACHED_HEADERS = {"content-encoding", "content-length", "transfer-encoding", "connection"}
+
+
+class CachedResponse:
+    """The parts of an `httpx.Response` plugins use, whether cached or not.
+
+    `complete` is False if only the start of the body was downloaded.
+    """
+
+    def __init__(self, url, status_code, headers, content, from_cache=False, complete=True):
+        self.url = url
+        self.status_code = status_code
+        self.headers = httpx.Headers(headers)
+        self.content = content
+        self.from_cache = from_cache
+        self.complete = complete
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding, errors="replace")
+
+    @property
+    def encoding(self):
+        for param in self.headers.get("content-type", "").split(";")[1:]:
+            key, _, value = param.strip().partition("=")
+            if key.lower() == "charset":
+                return value.strip("\"'")
+        return "utf-8"
+
+
+class FetchCache:
+    def __init__(
+        self, directory=CACHE_DIR, ttl=TTL, max_bytes=MAX_BYTES, client=http_client, busy_timeout=10.0
+    ):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        # seconds to wait for another connection's write lock on the index
+        self.busy_timeout = busy_timeout
+        self.client = client
+        self.lock = threading.Lock()
+        self.db = None
+
+    def connect(self):
+        if self.db is None:
+            os.makedirs(os.path.join(self.directory, "objects"), exist_ok=True)
+            db = sqlite3.connect(
+                os.path.join(self.directory, "index.sqlite3"),
+                timeout=self.busy_timeout,
+                check_same_thread=False,
+            )
+            db.execute(
+                """CREATE TABLE IF NOT EXISTS responses (
+                    url TEXT PRIMARY KEY,
+                    digest TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    status INTEGER NOT NULL,
+                    headers TEXT NOT NULL,
+                    etag TEXT,
+                    last_modified TEXT,
+                    stored_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )"""
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)"
+            )
+            self.db = db
+        return self.db
+
+    def failed(self, action, key, e):
+        """Log a cache error and roll back whatever the failed write left open."""
+        print(f"Fetch cache could not {action} {key}: {e!r}")
+        with self.lock:
+            if self.db is not None:
+                try:
+                    self.db.rollback()
+                except sqlite3.Error:
+                    pass
+
+    def object_path(self, digest):
+        return os.path.join(self.directory, "objects", digest[:2], digest)
+
+    def lookup(self, key):
+        """The cached response for key, or None if there isn't one or it can't be read."""
+        try:
+            with self.lock:
+                row = self.connect().execute(
+                    "SELECT digest, status, headers, etag, last_modified, stored_at FROM responses WHERE url = ?",
+                    (key,),
+                ).fetchone()
+            if row is None:
+                return None
+            digest, status, headers, etag, last_modified, stored_at = row
+            try:
+                with open(self.object_path(digest), "rb") as f:
+                    content = f.read()
+            except FileNotFoundError:
+                return None
+        except CACHE_ERRORS as e:
+            self.failed("read", key, e)
+            return None
+        return {
+            "status": status,
+            "headers": json.loads(headers),
+            "etag": etag,
+            "last_modified": last_modified,
+            "stored_at": stored_at,
+            "content": content,
+        }
+
+    def touch(self, key, refreshed=False):
+        now = time.time()
+        try:
+            with self.lock:
+                if refreshed:
+                    self.connect().execute(
+                        "UPDATE responses SET stored_at = ?, accessed_at = ? WHERE url = ?",
+                        (now, now, key),
+                    )
+                else:
+                    self.connect().execute(
+                        "UPDATE responses SET accessed_at = ? WHERE url = ?", (now, key)
+                    )
+                self.db.commit()
+        except CACHE_ERRORS as e:
+            self.failed("touch", key, e)
+
+    def store(self, key, response: CachedResponse):
+        """Cache a response; if the cache can't be written to, it just isn't cached."""
+        digest = hashlib.sha256(response.content).hexdigest()
+        path = self.object_path(digest)
+        now = time.time()
+        try:
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(response.content)
+                os.replace(tmp_path, path)
+            with self.lock:
+                self.connect().execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        key,
+                        digest,
+                        len(response.content),
+                        response.status_code,
+                        json.dumps(
+                            {
+                                key: value
+                                for key, value in response.headers.items()
+                                if key.lower() not in UNCACHED_HEADERS
+                            }
+                        ),
+                        response.headers.get("etag"),
+                        response.headers.get("last-modified"),
+                        now,
+                        now,
+                    ),
+                )
+                self.db.commit()
+        except CACHE_ERRORS as e:
+            self.failed("store", key, e)
+            return
+        self.evict()
+
+    def evict(self):
+        """Drop least recently used responses until the cache fits in max_bytes."""
+        try:
+            with self.lock:
+                db = self.connect()
+                (total,) = db.execute(
+                    "SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT digest, size FROM responses)"
+                ).fetchone()
+                if total <= self.max_bytes:
+                    return
+                for key, digest, size in db.execute(
+                    "SELECT url, digest, size FROM responses ORDER BY accessed_at"
+                ).fetchall():
+                    db.execute("DELETE FROM responses WHERE url = ?", (key,))
+                    (shared,) = db.execute(
+                        "SELECT COUNT(*) FROM responses WHERE digest = ?", (digest,)
+                    ).fetchone()
+                    if not shared:
+                        total -= size
+                        try:
+                            os.remove(self.object_path(digest))
+                        except FileNotFoundError:
+                            pass
+                    if total <= self.max_bytes:
+                        break
+                db.commit()
+        except CACHE_ERRORS as e:
+            self.failed("evict from", self.directory, e)
+
+    def get(self, url, headers=None, timeout=None, max_bytes=None, accept=None) -> CachedResponse:
+        """GET a url, serving it from the cache while fresh and revalidating it once stale.
+
+        The body is streamed, so a caller can look at the headers and the
+        start of it before the rest is downloaded.
+
+        Args:
+            url: The url to fetch.
+            headers: Extra request headers.
+            timeout: Request timeout, the client's by default.
+            max_bytes: Raise ResponseTooLarge instead of downloading a larger
+                body; checked against content-length before reading, if the
+                server sends one.
+            accept: Called with the response headers and the first SNIFF_BYTES
+                of the body. If it returns False, the download stops there and
+                the response is returned incomplete, and isn't cached. Bodies
+                shorter than SNIFF_BYTES are always downloaded whole.
+        """
+        key = normalize_url(url)
+        cached = self.lookup(key)
+        if cached is not None and time.time() - cached["stored_at"] < self.ttl:
+            self.touch(key)
+            return CachedResponse(url, cached["status"], cached["headers"], cached["content"], from_cache=True)
+
+        request_headers = dict(headers or {})
+        if cached is not None:
+            if cached["etag"]:
+                request_headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                request_headers["If-Modified-Since"] = cached["last_modified"]
+
+        budget = current_budget()
+        if budget is not None:
+            budget.check()
+            timeout = budget.timeout(timeout)
+        with self.client.stream("GET", url, headers=request_headers, timeout=timeout or self.client.timeout) as r:
+            if r.status_code == 304 and cached is not None:
+                self.touch(key, refreshed=True)
+                return CachedResponse(url, cached["status"], cached["headers"], cached["content"], from_cache=True)
+            content, complete = self.read_body(url, r, max_bytes, accept, budget)
+
+        response = CachedResponse(url, r.status_code, r.headers, content, complete=complete)
+        if complete and r.status_code == 200 and "no-store" not in r.headers.get("cache-control", ""):
+            self.store(key, response)
+        return response
+
+    def read_body(self, url, r, max_bytes, accept, budget):
+        """Read a streamed response's body, stopping early if it's too large or not wanted.
+
+        Returns:
+            A (content, complete) tuple; content is only the start of the body
+            if accept turned it down.
+
+        Raises:
+            BudgetExceeded: The crawl's budget ran out during the download.
+        """
+        length = r.headers.get("content-length")
+        if max_bytes is not None and length and length.isdigit() and int(length) > max_bytes:
+            raise ResponseTooLarge(url, r, int(length), max_bytes)
+        content = bytearray()
+        for chunk in r.iter_bytes():
+            content += chunk
+            if budget is not None:
+                # stops the download, and closes the stream, once the deadline
+                # passes or the bytes run out
+                budget.charge_bytes(len(chunk))
+                budget.check()
+            if max_bytes is not None and len(content) > max_bytes:
+                raise ResponseTooLarge(url, r, None, max_bytes)
+            if accept is not None and len(content) >= SNIFF_BYTES:
+                if not accept(r.headers, bytes(content[:SNIFF_BYTES])):
+                    return bytes(content), False
+                accept = None
+        return bytes(content), True
+
+
+fetch_cache = FetchCache()
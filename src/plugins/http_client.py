@@ -0,0 +1,46 @@
+"""Shared HTTP client for plugin network I/O.
+
+All plugins fetch through the module level `http_client` (directly or via
+`fetch_cache`) so connections are kept alive and reused across requests
+instead of paying for a new TCP and TLS handshake every time. It is an
+`httpx.Client`, which is safe to share between threads.
+
+The user agent can be set with BEATNIK_USER_AGENT. HTTP/2 is used when the
+`h2` package is installed and BEATNIK_HTTP2 isn't "0".
+"""
+import os
+
+import httpx
+
+USER_AGENT = os.environ.get(
+    "BEATNIK_USER_AGENT",
+    "Mozilla/5.0 (compatible; Beatnik/1.0; +https://github.com/orph/beatnik)",
+)
+
+# connect quickly or give up, but allow slow reads for large documents
+TIMEOUT = httpx.Timeout(30.0, connect=5.0)
+
+LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30)
+
+
+def http2_available() -> bool:
+    if os.environ.get("BEATNIK_HTTP2", "1") == "0":
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def create_client(user_agent=USER_AGENT, timeout=TIMEOUT, limits=LIMITS, http2=None) -> httpx.Client:
+    return httpx.Client(
+        headers={"user-agent": user_agent},
+        timeout=timeout,
+        limits=limits,
+        http2=http2_available() if http2 is None else http2,
+        follow_redirects=True,
+    )
+
+
+http_client = create_client()
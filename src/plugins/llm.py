@@ -0,0 +1,163 @@
+"""Shared, rate-budgeted LLM client.
+
+Every plugin sends completions through the module level `llm_client`. It
+runs an asyncio event loop on a background thread, so any number of scraping
+threads can submit prompts and the client overlaps their calls while keeping,
+for the whole process:
+
+- at most `max_concurrency` completions in flight,
+- under `requests_per_minute` and `tokens_per_minute` (token buckets),
+- retrying rate-limit and transient API errors with exponential backoff.
+
+Configured from the environment:
+
+    BEATNIK_LLM_BACKEND       "openai" (default) or "stub" for tests
+    BEATNIK_LLM_CONCURRENCY   completions in flight, default 8
+    BEATNIK_LLM_RPM           requests per minute, default 3000
+    BEATNIK_LLM_TPM           tokens per minute, default 250000
+
+The limits apply per container; divide the account limits by the number of
+containers that summarize at once.
+"""
+import asyncio
+import os
+import random
+import threading
+
+from crawler.scheduler import TokenBucket
+from .tokens import count_tokens
+
+
+def retryable_errors():
+    import openai
+
+    names = ["RateLimitError", "APIError", "Timeout", "ServiceUnavailableError", "APIConnectionError", "TryAgain"]
+    error_module = getattr(openai, "error", None)
+    return tuple(getattr(error_module, name) for name in names if hasattr(error_module, name))
+
+
+class OpenAIBackend:
+    requires_api_key = True
+    cacheable = True
+
+    async def complete(self, prompt: str, model: str, params: dict) -> str:
+        import openai
+
+        if hasattr(openai.Completion, "acreate"):
+            response = await openai.Completion.acreate(model=model, prompt=prompt, **params)
+        else:
+            loop = asyncio.get_running_loop()
+            response = await loop.run_in_executor(
+                None, lambda: openai.Completion.create(model=model, prompt=prompt, **params)
+            )
+        return response.to_dict_recursive()["choices"][0]["text"].strip()
+
+
+class StubBackend:
+    """Local stand-in for the model: the "summary" is the start of the prompt."""
+
+    requires_api_key = False
+    # keep stub summaries out of the persistent summary cache
+    cacheable = False
+
+    def __init__(self, words=30):
+        self.words = words
+        self.calls = 0
+
+    async def complete(self, prompt: str, model: str, params: dict) -> str:
+        self.calls += 1
+        return "Summary: " + " ".join(prompt.split()[:self.words])
+
+
+BACKENDS = {
+    "openai": OpenAIBackend,
+    "stub": StubBackend,
+}
+
+
+class LLMClient:
+    def __init__(self, backend, max_concurrency=8, requests_per_minute=3000, tokens_per_minute=250_000, max_retries=5):
+        self.backend = backend
+        self.max_concurrency = max_concurrency
+        self.requests = TokenBucket(requests_per_minute / 60, requests_per_minute / 60)
+        self.tokens = TokenBucket(tokens_per_minute / 60, tokens_per_minute / 60)
+        self.max_retries = max_retries
+        self.loop = None
+        self.semaphore = None
+        self.lock = threading.Lock()
+
+    def get_loop(self):
+        with self.lock:
+            if self.loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, daemon=True).start()
+                self.loop = loop
+            return self.loop
+
+    def estimate_tokens(self, prompt: str, model: str, params: dict) -> int:
+        # completion tokens count against the limit as well, once per best_of
+        return count_tokens(prompt, model) + params.get("max_tokens", 16) * params.get("best_of", 1)
+
+    async def wait_for_budget(self, tokens: int):
+        while True:
+            delay = max(self.requests.delay(), self.tokens.delay(tokens))
+            if delay == 0:
+                self.requests.take()
+                self.tokens.take(tokens)
+                return
+            await asyncio.sleep(delay)
+
+    async def acomplete(self, prompt: str, model: str, params: dict) -> str:
+        """Complete a prompt. Must run on the client's own event loop."""
+        tokens = self.estimate_tokens(prompt, model, params)
+        if self.semaphore is None:
+            # created on the client's loop: before Python 3.10 a semaphore
+            # binds to the event loop of the thread that creates it
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self.semaphore:
+            for attempt in range(self.max_retries + 1):
+                await self.wait_for_budget(tokens)
+                try:
+                    return await self.backend.complete(prompt, model, params)
+                except retryable_errors() as e:
+                    if attempt == self.max_retries:
+                        raise
+                    backoff = min(60, 2 ** attempt) * (1 + random.random())
+                    print(f"{type(e).__name__}, retrying in {backoff:.1f}s")
+                    await asyncio.sleep(backoff)
+
+    def complete(self, prompt: str, model: str, params: dict) -> str:
+        """Complete a prompt from any thread, blocking until it's done."""
+        loop = self.get_loop()
+        return asyncio.run_coroutine_threadsafe(self.acomplete(prompt, model, params), loop).result()
+
+    def complete_many(self, prompts: list, model: str, params: dict, max_concurrency=None) -> list:
+        """Complete several prompts concurrently from any thread.
+
+        Returns:
+            A completion, or the exception raised for it, per prompt.
+        """
+        loop = self.get_loop()
+
+        async def complete_all():
+            limit = asyncio.Semaphore(max_concurrency or len(prompts) or 1)
+
+            async def complete_one(prompt):
+                async with limit:
+                    return await self.acomplete(prompt, model, params)
+
+            return await asyncio.gather(*(complete_one(prompt) for prompt in prompts), return_exceptions=True)
+
+        return asyncio.run_coroutine_threadsafe(complete_all(), loop).result()
+
+
+def create_llm_client() -> LLMClient:
+    return LLMClient(
+        BACKENDS[os.environ.get("BEATNIK_LLM_BACKEND", "openai")](),
+        max_concurrency=int(os.environ.get("BEATNIK_LLM_CONCURRENCY", 8)),
+        requests_per_minute=float(os.environ.get("BEATNIK_LLM_RPM", 3000)),
+        tokens_per_minute=float(os.environ.get("BEATNIK_LLM_TPM", 250_000)),
+    )
+
+
+llm_client = create_llm_client()
@@ -0,0 +1,43 @@
+"""Plugin manifest.
+
+Lists the urls each plugin module handles so the scraper can route urls
+without importing any plugin; a plugin is imported the first time a url is
+routed to it. Keep each entry's domains in step with the plugin's
+`supported_domains`. See crawler.registry.PluginRegistry for how domains,
+path prefixes and extensions are matched.
+
+Plugin modules without an entry here still work, but are imported as soon as
+a scraper is created.
+"""
+import importlib
+import threading
+import time
+
+PLUGINS = {
+    "01_reddit": {"domains": ["reddit.com", "old.reddit.com"]},
+    "02_youtube": {"domains": ["youtube.com", "youtu.be"]},
+    "03_wikipedia": {"domains": ["en.wikipedia.org"]},
+    "04_googledocs": {"domains": ["docs.google.com"]},
+    "99_default": {"domains": ["*"]},
+}
+
+# seconds taken to import each plugin module in this process
+import_times = {}
+
+_lock = threading.Lock()
+
+
+def load_plugin_class(module_name):
+    """Import a plugin module, e.g. "02_youtube", and return its plugin class.
+
+    Plugin class names are determined by the module name, e.g. "YoutubePlugin".
+    """
+    with _lock:
+        if module_name not in import_times:
+            start = time.perf_counter()
+            importlib.import_module(f"plugins.{module_name}")
+            import_times[module_name] = time.perf_counter() - start
+            print(f"imported plugin {module_name} in {import_times[module_name]:.3f}s")
+    plugin_module = importlib.import_module(f"plugins.{module_name}")
+    plugin_class_name = module_name.split("_")[1].capitalize()
+    return getattr(plugin_module, f"{plugin_class_name}Plugin")
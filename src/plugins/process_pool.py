@@ -0,0 +1,180 @@
+"""Shared process pool for CPU-bound extraction.
+
+Plugins run parsing that keeps a core busy, like textract or big regexes,
+through the module level `process_pool` instead of in their own thread, so
+it runs in parallel with the network I/O of other pages:
+
+    text = process_pool.run(extract_text, content, extension)
+
+The function and its arguments are pickled to a worker process, so the
+function must be defined at module level. Workers are spawned rather than
+forked, as the scraper's threads may hold locks at fork time, and are
+started on first use.
+
+At most `max_queued` jobs wait for a free worker; callers submitting more
+block until there is room, so a burst of pages can't queue up unbounded
+copies of their content. `metrics()` reports how saturated the pool is, and
+is logged every BEATNIK_EXTRACTION_METRICS_INTERVAL seconds (default 60)
+while the pool is in use.
+
+A worker that dies, say of OOM or a segfault in a native parser, breaks
+the whole executor: the jobs it had fail with BrokenProcessPool, and the
+executor is replaced with a fresh one for the jobs after them.
+"""
+import atexit
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+PROCESSES = int(os.environ.get("BEATNIK_EXTRACTION_PROCESSES", os.cpu_count() or 1))
+METRICS_INTERVAL = float(os.environ.get("BEATNIK_EXTRACTION_METRICS_INTERVAL", 60))
+
+
+class ProcessPool:
+    """A pool of worker processes with a bounded queue.
+
+    Args:
+        processes: Worker processes; 0 runs every job in the calling thread.
+        max_queued: Jobs that may wait for a worker on top of those running,
+            twice the number of processes by default.
+        metrics_interval: Seconds between logs of the pool's metrics; None
+            never logs them.
+    """
+
+    def __init__(self, processes=PROCESSES, max_queued=None, metrics_interval=METRICS_INTERVAL):
+        self.processes = processes
+        self.max_queued = 2 * processes if max_queued is None else max_queued
+        self.slots = threading.BoundedSemaphore(processes + self.max_queued) if processes else None
+        self.executor = None
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        # jobs queued or running, and the most there have been at once
+        self.pending = 0
+        self.peak_pending = 0
+        # submissions that found the queue full, and how long they waited
+        self.waits = 0
+        self.wait_seconds = 0.0
+        # executors replaced after a worker died
+        self.restarts = 0
+        self.metrics_interval = metrics_interval
+        self.last_log = time.monotonic()
+
+    def get_executor(self) -> ProcessPoolExecutor:
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context("spawn"))
+            return self.executor
+
+    def replace_broken(self, executor):
+        """Drop an executor a dead worker has broken, unless another thread already has."""
+        with self.lock:
+            if self.executor is not executor:
+                return
+            self.executor = None
+            self.restarts += 1
+        print("extraction process pool broken by a dead worker, starting new workers")
+        executor.shutdown(wait=False)
+
+    def submit(self, fn, *args) -> Future:
+        """Start fn(*args) on a worker, first waiting for room in the queue if it is full."""
+        if self.slots is None:
+            future = Future()
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        if not self.slots.acquire(blocking=False):
+            start = time.monotonic()
+            self.slots.acquire()
+            with self.lock:
+                self.waits += 1
+                self.wait_seconds += time.monotonic() - start
+        with self.lock:
+            self.submitted += 1
+            self.pending += 1
+            self.peak_pending = max(self.peak_pending, self.pending)
+        try:
+            executor = self.get_executor()
+            try:
+                future = executor.submit(fn, *args)
+            except BrokenProcessPool:
+                self.replace_broken(executor)
+                executor = self.get_executor()
+                future = executor.submit(fn, *args)
+        except Exception:
+            self.job_done(failed=True)
+            raise
+        future.add_done_callback(lambda future: self.job_finished(executor, future))
+        self.log_metrics()
+        return future
+
+    def job_finished(self, executor, future):
+        error = future.exception()
+        if isinstance(error, BrokenProcessPool):
+            self.replace_broken(executor)
+        self.job_done(failed=error is not None)
+
+    def job_done(self, failed):
+        with self.lock:
+            self.pending -= 1
+            if failed:
+                self.failed += 1
+            else:
+                self.completed += 1
+        self.slots.release()
+
+    def run(self, fn, *args):
+        """Call fn(*args) on a worker and return its result."""
+        return self.submit(fn, *args).result()
+
+    def metrics(self) -> dict:
+        """How busy the pool is.
+
+        running and queued are the jobs on workers and waiting for one;
+        saturation is the share of the queue in use, and at 1 submissions
+        block. waits and wait_seconds add up the submissions that did.
+        """
+        with self.lock:
+            capacity = self.processes + self.max_queued
+            return {
+                "processes": self.processes,
+                "max_queued": self.max_queued,
+                "running": min(self.pending, self.processes),
+                "queued": max(0, self.pending - self.processes),
+                "saturation": self.pending / capacity if capacity else 0.0,
+                "peak_pending": self.peak_pending,
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "waits": self.waits,
+                "wait_seconds": round(self.wait_seconds, 3),
+                "restarts": self.restarts,
+            }
+
+    def log_metrics(self):
+        """Print the metrics if metrics_interval has passed since they last were."""
+        if self.metrics_interval is None:
+            return
+        with self.lock:
+            if time.monotonic() - self.last_log < self.metrics_interval:
+                return
+            self.last_log = time.monotonic()
+        print("extraction process pool:", self.metrics())
+
+    def close(self):
+        """Stop the worker processes, after the jobs already submitted."""
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown()
+
+
+process_pool = ProcessPool()
+atexit.register(process_pool.close)
@@ -0,0 +1,136 @@
+"""Content type detection from the first bytes of a response.
+
+Servers often send no content-type, a generic one like
+application/octet-stream, or the wrong one, so the type is worked out from
+the body's magic number where it has one, then from the declared type, and
+finally from the look of the text or the url's extension.
+
+    content_type = sniff_content_type(r.headers.get("content-type"), r.content[:SNIFF_BYTES], url)
+"""
+import mimetypes
+from urllib.parse import urlsplit
+
+# content types that say nothing about the body
+GENERIC_TYPES = {
+    "",
+    "application/octet-stream",
+    "binary/octet-stream",
+    "application/unknown",
+    "application/download",
+    "application/force-download",
+    "application/x-download",
+}
+
+# (offset, magic number, content type)
+SIGNATURES = [
+    (0, b"%PDF-", "application/pdf"),
+    (0, b"%!PS", "application/postscript"),
+    (0, b"{\\rtf", "application/rtf"),
+    (0, b"\x89PNG\r\n\x1a\n", "image/png"),
+    (0, b"\xff\xd8\xff", "image/jpeg"),
+    (0, b"GIF87a", "image/gif"),
+    (0, b"GIF89a", "image/gif"),
+    (0, b"II*\x00", "image/tiff"),
+    (0, b"MM\x00*", "image/tiff"),
+    (8, b"WEBP", "image/webp"),
+    (8, b"WAVE", "audio/x-wav"),
+    (0, b"ID3", "audio/mpeg"),
+    (0, b"\xff\xfb", "audio/mpeg"),
+    (0, b"\xff\xf3", "audio/mpeg"),
+    (0, b"OggS", "audio/ogg"),
+    (4, b"ftyp", "video/mp4"),
+    (0, b"\x1f\x8b", "application/gzip"),
+    (0, b"MZ", "application/x-msdownload"),
+    (0, b"\x7fELF", "application/x-executable"),
+]
+
+ZIP_MAGIC = b"PK\x03\x04"
+OLE_MAGIC = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+
+# zip based formats, by the name of a file near the start of the archive
+ZIP_MEMBERS = [
+    (b"mimetypeapplication/epub+zip", "application/epub+zip"),
+    (b"mimetypeapplication/vnd.oasis.opendocument.text", "application/vnd.oasis.opendocument.text"),
+    (b"word/", "application/vnd.openxmlformats-officedocument.wordprocessingml.document"),
+    (b"xl/", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"),
+    (b"ppt/", "application/vnd.openxmlformats-officedocument.presentationml.presentation"),
+]
+
+# the legacy Office formats all share the OLE container
+OLE_TYPES = {
+    "application/msword",
+    "application/vnd.ms-excel",
+    "application/vnd.ms-powerpoint",
+    "application/vnd.ms-outlook",
+}
+
+HTML_PREFIXES = (b"<!doctype html", b"<html", b"<head", b"<body", b"<script", b"<title", b"<meta")
+
+
+def media_type(content_type) -> str:
+    """A content-type header without its parameters, lowercased."""
+    return (content_type or "").split(";")[0].strip().lower()
+
+
+def match_signature(head: bytes):
+    for offset, magic, content_type in SIGNATURES:
+        if head[offset:offset + len(magic)] == magic:
+            if magic in (b"WEBP", b"WAVE") and not head.startswith(b"RIFF"):
+                continue
+            return content_type
+    return None
+
+
+def looks_like_text(head: bytes) -> bool:
+    if b"\x00" in head:
+        return False
+    try:
+        head.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # the sample may end in the middle of a character
+        return e.start >= len(head) - 3
+    return True
+
+
+def sniff_content_type(declared, head: bytes, url=None):
+    """The content type of a response, from its declared type and first bytes.
+
+    Args:
+        declared: The content-type header, if any.
+        head: The first bytes of the body; the more the better, up to SNIFF_BYTES.
+        url: The url, whose extension is the last resort for unknown types.
+
+    Returns:
+        A content type; the declared one, parameters included, unless the
+        body says otherwise. None if there is nothing to go on.
+    """
+    declared_type = media_type(declared)
+    if head.startswith(ZIP_MAGIC):
+        for member, content_type in ZIP_MEMBERS:
+            if member in head:
+                return content_type
+        if declared_type not in GENERIC_TYPES:
+            return declared
+        return guess_type(url) or "application/zip"
+    if head.startswith(OLE_MAGIC):
+        if declared_type in OLE_TYPES:
+            return declared
+        guessed = guess_type(url)
+        return guessed if guessed in OLE_TYPES else "application/msword"
+
+    content_type = match_signature(head)
+    if content_type is not None:
+        return content_type
+    if declared_type not in GENERIC_TYPES:
+        return declared
+    if head and looks_like_text(head):
+        if head.lstrip(b"\xef\xbb\xbf \t\r\n").lower().startswith(HTML_PREFIXES):
+            return "text/html"
+        return guess_type(url) or "text/plain"
+    return guess_type(url) or declared or None
+
+
+def guess_type(url):
+    if not url:
+        return None
+    return mimetypes.guess_type(urlsplit(url).path)[0]
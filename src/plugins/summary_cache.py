@@ -0,0 +1,118 @@
+"""Two-tier cache of LLM summaries.
+
+Summaries are keyed by a hash of the model, its parameters and the prompt,
+so a byte-identical page summarized with the same settings is never sent to
+the LLM twice. Recently used summaries are kept in an in-process LRU; all of
+them are persisted to SQLite next to the fetch cache, which keeps at most
+`max_entries` rows and drops the least recently used ones first.
+
+Like the fetch cache, the SQLite tier is best-effort: if it is locked or
+can't be read or written, the error is logged and the summary is treated as
+uncached, or kept in memory only.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from .fetch_cache import CACHE_DIR, CACHE_ERRORS
+
+
+def summary_key(model: str, params: dict, prompt: str) -> str:
+    key = hashlib.sha256()
+    key.update(json.dumps([model, params], sort_keys=True).encode("utf-8"))
+    key.update(b"\0")
+    key.update(prompt.encode("utf-8"))
+    return key.hexdigest()
+
+
+class SummaryCache:
+    def __init__(
+        self,
+        path=os.path.join(CACHE_DIR, "summaries.sqlite3"),
+        memory_size=1024,
+        max_entries=100_000,
+        busy_timeout=10.0,
+    ):
+        self.path = path
+        self.memory_size = memory_size
+        self.max_entries = max_entries
+        self.busy_timeout = busy_timeout
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.db = None
+
+    def connect(self):
+        if self.db is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            db = sqlite3.connect(self.path, timeout=self.busy_timeout, check_same_thread=False)
+            db.execute(
+                """CREATE TABLE IF NOT EXISTS summaries (
+                    key TEXT PRIMARY KEY,
+                    summary TEXT NOT NULL,
+                    accessed_at REAL NOT NULL
+                )"""
+            )
+            db.execute(
+                "CREATE INDEX IF NOT EXISTS summaries_accessed_at ON summaries (accessed_at)"
+            )
+            self.db = db
+        return self.db
+
+    def failed(self, action, e):
+        # called with the lock held
+        print(f"Summary cache could not {action} {self.path}: {e!r}")
+        if self.db is not None:
+            try:
+                self.db.rollback()
+            except sqlite3.Error:
+                pass
+
+    def remember(self, key, summary):
+        self.memory[key] = summary
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.memory_size:
+            self.memory.popitem(last=False)
+
+    def get(self, key):
+        """The cached summary for a key, or None."""
+        with self.lock:
+            if key in self.memory:
+                self.memory.move_to_end(key)
+                return self.memory[key]
+            try:
+                db = self.connect()
+                row = db.execute("SELECT summary FROM summaries WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    return None
+                db.execute("UPDATE summaries SET accessed_at = ? WHERE key = ?", (time.time(), key))
+                db.commit()
+            except CACHE_ERRORS as e:
+                self.failed("read", e)
+                return None
+            self.remember(key, row[0])
+            return row[0]
+
+    def put(self, key, summary):
+        with self.lock:
+            self.remember(key, summary)
+            try:
+                db = self.connect()
+                db.execute(
+                    "INSERT OR REPLACE INTO summaries VALUES (?, ?, ?)", (key, summary, time.time())
+                )
+                (count,) = db.execute("SELECT COUNT(*) FROM summaries").fetchone()
+                if count > self.max_entries:
+                    db.execute(
+                        "DELETE FROM summaries WHERE key IN (SELECT key FROM summaries ORDER BY accessed_at LIMIT ?)",
+                        (count - self.max_entries,),
+                    )
+                db.commit()
+            except CACHE_ERRORS as e:
+                self.failed("write to", e)
+
+
+summary_cache = SummaryCache()
@@ -0,0 +1,50 @@
+"""Token counting and token-budgeted splitting of text for LLM prompts.
+
+Uses tiktoken's encoding for the summary model when it is installed and falls
+back to an estimate of 4 characters per token otherwise, which badly
+undercounts non-Latin text. tiktoken is only imported when text is first
+counted; it downloads its encodings on first use, so the image fetches them
+when it is built.
+"""
+CHARS_PER_TOKEN = 4
+
+_encodings = {}
+
+
+def get_encoding(model: str):
+    if model not in _encodings:
+        try:
+            import tiktoken
+        except ImportError:
+            _encodings[model] = None
+            return None
+        try:
+            _encodings[model] = tiktoken.encoding_for_model(model)
+        except KeyError:
+            print(f"tiktoken has no encoding for {model}, estimating its tokens")
+            _encodings[model] = None
+        except OSError as e:
+            # the encoding couldn't be downloaded or read from tiktoken's cache
+            print(f"Could not load the tiktoken encoding for {model}, estimating its tokens: {e!r}")
+            _encodings[model] = None
+    return _encodings[model]
+
+
+def count_tokens(text: str, model: str) -> int:
+    encoding = get_encoding(model)
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def split_tokens(text: str, max_tokens: int, model: str) -> list:
+    """Split text into consecutive chunks of at most max_tokens tokens each."""
+    encoding = get_encoding(model)
+    if encoding is None:
+        size = max_tokens * CHARS_PER_TOKEN
+        return [text[i:i + size] for i in range(0, len(text), size)]
+    tokens = encoding.encode(text, disallowed_special=())
+    return [
+        encoding.decode(tokens[i:i + max_tokens])
+        for i in range(0, len(tokens), max_tokens)
+    ]
@@ -1,5 +1,29 @@
 import os
-import openai
+
+from crawler.budget import current_budget
+
+from .llm import llm_client
+from .summary_cache import summary_cache, summary_key
+from .tokens import count_tokens, split_tokens
+
+SUMMARY_MODEL = "text-davinci-003"
+SUMMARY_PARAMS = {
+    "temperature": 0.0,
+    "max_tokens": 1000,
+    "top_p": 1,
+    "best_of": 3,
+    "frequency_penalty": 0,
+    "presence_penalty": 0,
+}
+
+# text-davinci-003's context window is shared by the prompt and the completion
+SUMMARY_CONTEXT_TOKENS = 4097
+SUMMARY_PROMPT_TOKENS = SUMMARY_CONTEXT_TOKENS - SUMMARY_PARAMS["max_tokens"] - 97
+# most chunk summaries requested at once for a single document
+SUMMARY_FAN_OUT = 4
+
+REDUCE_PREFIX = "The following are summaries of consecutive parts of the same text.\n\n"
+REDUCE_SUFFIX = "\n\nCombine them into a single summary."
 
 
 def url_to_param_dict(url: str) -> dict:
@@ -23,35 +47,116 @@ class BasePlugin:
 
     def setup_credentials(self):
         """Set up the credentials for the plugin from environment."""
+        import openai
+
         self.api_key = os.environ.get("OPENAI_API_KEY")
         openai.api_key = self.api_key
 
+    def can_summarize(self) -> bool:
+        return bool(self.api_key) or not llm_client.backend.requires_api_key
+
     def summarizer(self, prompt: str) -> str:
         """Call LLM to summarize the given prompt.
 
+        Summaries are cached by model, parameters and prompt, so an unchanged
+        prompt is only ever summarized once.
+
         Args:
             prompt (str): The prompt to summarize.
         """
 
-        if not self.api_key:
-            return ""
+        return self.summarize_many([prompt])[0]
+
+    def summarize_many(self, prompts: list, max_concurrency=None) -> list:
+        """Summarize several prompts concurrently through the shared LLM client.
+
+        Args:
+            prompts (list): The prompts to summarize.
+            max_concurrency (int): Most prompts of this call in flight at once.
 
-        try:
-            response = openai.Completion.create(
-                model="text-davinci-003",
-                prompt=prompt,
-                temperature=0.0,
-                max_tokens=1000,
-                top_p=1,
-                best_of=3,
-                frequency_penalty=0,
-                presence_penalty=0,
+        Returns:
+            A summary per prompt; "error" for prompts that failed and "" for
+            those skipped because the crawl's budget ran out.
+        """
+
+        if not self.can_summarize():
+            return ["" for _ in prompts]
+
+        cacheable = llm_client.backend.cacheable
+        keys = [summary_key(SUMMARY_MODEL, SUMMARY_PARAMS, prompt) for prompt in prompts]
+        summaries = [summary_cache.get(key) if cacheable else None for key in keys]
+        missing = [i for i, summary in enumerate(summaries) if summary is None]
+        budget = current_budget()
+        if budget is not None and missing:
+            # only send the prompts the crawl's token budget still has room for
+            within = [
+                i for i in missing
+                if budget.exhausted() is None
+                and budget.try_charge_tokens(llm_client.estimate_tokens(prompts[i], SUMMARY_MODEL, SUMMARY_PARAMS))
+            ]
+            for i in set(missing) - set(within):
+                summaries[i] = ""
+            missing = within
+        if missing:
+            completions = llm_client.complete_many(
+                [prompts[i] for i in missing],
+                SUMMARY_MODEL,
+                SUMMARY_PARAMS,
+                max_concurrency=max_concurrency,
             )
+            for i, completion in zip(missing, completions):
+                if isinstance(completion, Exception):
+                    print(completion)
+                    summaries[i] = "error"
+                else:
+                    if cacheable:
+                        summary_cache.put(keys[i], completion)
+                    summaries[i] = completion
+        return summaries
+
+    def summarize_long(self, text: str, prefix: str = "", suffix: str = "", max_depth: int = 4) -> str:
+        """Summarize text of any length.
+
+        Text that fits in the model's context is summarized with a single
+        prefix + text + suffix prompt. Longer text is split into token-budgeted
+        chunks which are summarized in parallel (at most SUMMARY_FAN_OUT at a
+        time), and the chunk summaries are then combined, again in chunks if
+        they don't fit, until a single summary is left.
+
+        Args:
+            text (str): The text to summarize.
+            prefix (str): Instructions placed before the text.
+            suffix (str): Instructions placed after the text.
+            max_depth (int): How many levels of chunk summaries may be combined
+                before the rest is truncated to fit.
+        """
+
+        if not self.can_summarize():
+            return ""
+
+        budget = SUMMARY_PROMPT_TOKENS - count_tokens(prefix + suffix, SUMMARY_MODEL)
+        if count_tokens(text, SUMMARY_MODEL) <= budget:
+            return self.summarizer(prefix + text + suffix)
+        if max_depth == 0:
+            return self.summarizer(prefix + split_tokens(text, budget, SUMMARY_MODEL)[0] + suffix)
 
-            return response.to_dict_recursive()["choices"][0]["text"].strip()
-        except Exception as e:
-            print(e)
+        chunks = split_tokens(text, budget, SUMMARY_MODEL)
+        summaries = self.summarize_many(
+            [prefix + chunk + suffix for chunk in chunks],
+            max_concurrency=SUMMARY_FAN_OUT,
+        )
+        summaries = [summary for summary in summaries if summary and summary != "error"]
+        if not summaries:
             return "error"
+        if len(summaries) == 1:
+            return summaries[0]
+
+        return self.summarize_long(
+            "\n\n".join(summaries),
+            prefix=REDUCE_PREFIX,
+            suffix=REDUCE_SUFFIX,
+            max_depth=max_depth - 1,
+        )
 
 
 document_extensions = {
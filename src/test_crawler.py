@@ -0,0 +1,320 @@
+import os
+import time
+from concurrent.futures.process import BrokenProcessPool
+
+import httpx
+import pytest
+
+from crawler.budget import BudgetExceeded, CrawlBudget, use_budget
+from crawler.distributed import ShardFrontier
+from crawler.frontier import Frontier, PriorityFrontier
+from crawler.jobs import JobStore
+from crawler.registry import PluginRegistry, normalize_hostname
+from crawler.scheduler import HostScheduler, TokenBucket
+from crawler.urls import canonicalize_url, url_key
+from crawler.visited import BloomVisitedSet
+from plugins.fetch_cache import FetchCache
+from plugins.llm import LLMClient, StubBackend
+from plugins.process_pool import ProcessPool
+from plugins.sniff import sniff_content_type
+from plugins.tokens import CHARS_PER_TOKEN, count_tokens
+
+
+def test_job_results_cursor_is_stable():
+    jobs = JobStore({})
+    jobs.create("job", ["https://a.com", "https://b.com"])
+    jobs.record_page("job", 1, "https://b.com/1", {"content": "b1"}, queued=0)
+
+    page = jobs.results("job", page_size=1)
+    assert [result["url"] for result in page["results"]] == ["https://b.com/1"]
+
+    # an earlier seed finishing a page must not shift what the cursor has seen
+    jobs.record_page("job", 0, "https://a.com/1", {"content": "a1"}, queued=0)
+    page = jobs.results("job", page["cursor"], page_size=1)
+    assert [result["url"] for result in page["results"]] == ["https://a.com/1"]
+    assert jobs.results("job", page["cursor"])["results"] == []
+
+
+def test_only_failed_or_stale_seeds_resume():
+    jobs = JobStore({})
+    jobs.create("job", ["https://a.com", "https://b.com", "https://c.com"])
+    jobs.start_seed("job", 0)
+    jobs.start_seed("job", 1)
+    jobs.finish_seed("job", 1, error="boom")
+    jobs.start_seed("job", 2)
+    jobs.update_seed("job", 2, heartbeat=0)
+    assert jobs.resumable_seeds("job") == ([1, 2], [0])
+
+    jobs.resume_seed("job", 1)
+    jobs.resume_seed("job", 2)
+    assert jobs.resumable_seeds("job") == ([], [0, 1, 2])
+
+    # a seed still waiting for a container is never taken for dead
+    jobs.update_seed("job", 1, heartbeat=0)
+    assert jobs.resumable_seeds("job") == ([], [0, 1, 2])
+
+
+def test_frontier_skips_throttled_hosts_in_order():
+    frontier = Frontier(["https://a.com/1", "https://b.com/1", "https://a.com/2", "https://c.com/1", "https://b.com/2"])
+    tested = []
+
+    def ready(url):
+        tested.append(url)
+        return not url.startswith("https://a.com")
+
+    assert frontier.pop_first(ready) == "https://b.com/1"
+    # only each host's first url is tested
+    assert tested == ["https://a.com/1", "https://b.com/1"]
+    assert frontier.pop_first(ready) == "https://c.com/1"
+    assert frontier.pop_first(ready) == "https://b.com/2"
+    assert frontier.pop_first(ready) is None
+    assert [frontier.pop(), frontier.pop()] == ["https://a.com/1", "https://a.com/2"]
+    assert not frontier
+
+
+def test_best_first_order_under_host_throttling():
+    frontier = PriorityFrontier()
+    for url, score in [("https://a.com/1", 9), ("https://b.com/1", 5), ("https://a.com/2", 8),
+                       ("https://c.com/1", 1), ("https://b.com/2", 5), ("https://a.com/3", 7)]:
+        frontier.add(url, score)
+    # one page per host, then each host waits
+    scheduler = HostScheduler(rate=0.001, burst=1, respect_robots=False)
+
+    started = []
+    url = frontier.pop_first(scheduler.try_acquire)
+    while url is not None:
+        started.append(url)
+        url = frontier.pop_first(scheduler.try_acquire)
+    # the best url of each host that may start, best first
+    assert started == ["https://a.com/1", "https://b.com/1", "https://c.com/1"]
+    assert len(frontier) == 3
+    # equal scores keep the order they were added in
+    assert [frontier.pop() for _ in range(3)] == ["https://a.com/2", "https://a.com/3", "https://b.com/2"]
+
+
+def test_normalize_hostname():
+    assert normalize_hostname("WWW.Example.com.") == "example.com"
+    assert normalize_hostname("web.dev") == "web.dev"
+    assert normalize_hostname("www.web.dev") == "web.dev"
+    assert normalize_hostname("wwwx.com") == "wwwx.com"
+
+
+def test_registry_routes_urls():
+    registry = PluginRegistry()
+    registry.register("youtube", ["youtube.com", "youtu.be"])
+    registry.register("wikipedia", ["en.wikipedia.org"])
+    registry.register("sheets", ["docs.google.com/spreadsheets"])
+    registry.register("docs", ["docs.google.com"])
+    registry.register("pdf", [], extensions=["pdf"])
+    registry.register("default", ["*"])
+
+    assert registry.lookup("https://m.youtube.com/watch?v=1") == "youtube"
+    assert registry.lookup("https://www.youtube.com/watch?v=1") == "youtube"
+    assert registry.lookup("https://notyoutube.com/") == "default"
+    assert registry.lookup("https://en.wikipedia.org/wiki/NASA") == "wikipedia"
+    assert registry.lookup("https://de.wikipedia.org/wiki/NASA") == "default"
+    assert registry.lookup("https://docs.google.com/spreadsheets/d/1") == "sheets"
+    assert registry.lookup("https://docs.google.com/spreadsheetsx") == "docs"
+    assert registry.lookup("https://docs.google.com/document/d/1") == "docs"
+    assert registry.lookup("https://example.com/paper.PDF") == "pdf"
+    assert registry.lookup("https://youtube.com/paper.pdf") == "youtube"
+
+
+def test_canonicalize_url_keeps_the_query_as_written():
+    assert canonicalize_url("HTTPS://Example.COM:443/a/./b/../c?q=a%20b#top") == "https://example.com/a/c?q=a%20b"
+    assert canonicalize_url("https://example.com/search?flag") == "https://example.com/search?flag"
+    assert canonicalize_url("https://example.com/?next=/a/b&q=a+b") == "https://example.com/?next=/a/b&q=a+b"
+    assert canonicalize_url("https://example.com/?b=2&a=1&b=1") == "https://example.com/?a=1&b=2&b=1"
+    assert canonicalize_url("https://example.com/?utm_source=x&id=1&fbclid=y") == "https://example.com/?id=1"
+    assert canonicalize_url("http://example.com:8080/dir/") == "http://example.com:8080/dir/"
+    assert canonicalize_url("../b?x=1", base="https://example.com/a/c") == "https://example.com/b?x=1"
+    assert canonicalize_url("mailto:someone@example.com") is None
+    assert canonicalize_url("") is None
+
+
+def test_url_key_merges_spellings_of_a_page():
+    assert url_key("https://www.example.com/a/?b=1&a=2") == url_key("http://example.com/a?a=2&b=1")
+    assert url_key("https://example.com/a?q=a%20b") != url_key("https://example.com/a?q=a%2520b")
+
+
+def test_bloom_visited_set():
+    visited = BloomVisitedSet(capacity=10_000, error_rate=0.01)
+    added = sum(visited.add(f"example.com/{i}") for i in range(0, 20_000, 2))
+    # a new key is occasionally taken for one already seen, but a seen one never for new
+    assert added > 10_000 * 0.98 and len(visited) == added
+    assert all(f"example.com/{i}" in visited for i in range(0, 20_000, 2))
+    assert not visited.add("example.com/0")
+    false_positives = sum(f"example.com/{i}" in visited for i in range(1, 20_000, 2))
+    assert false_positives < 10_000 * 0.02
+
+
+def test_sniff_zip_and_ole_members():
+    docx = b"PK\x03\x04" + b"\x00" * 26 + b"[Content_Types].xml...word/document.xml"
+    assert sniff_content_type(None, docx) == "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+    epub = b"PK\x03\x04" + b"\x00" * 26 + b"mimetypeapplication/epub+zip"
+    assert sniff_content_type("application/zip", epub) == "application/epub+zip"
+    other_zip = b"PK\x03\x04" + b"\x00" * 26 + b"data.csv"
+    assert sniff_content_type("application/octet-stream", other_zip, "https://a.com/files") == "application/zip"
+    assert sniff_content_type("application/x-zip-compressed", other_zip) == "application/x-zip-compressed"
+
+    ole = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1" + b"\x00" * 100
+    assert sniff_content_type("application/vnd.ms-excel", ole) == "application/vnd.ms-excel"
+    assert sniff_content_type(None, ole, "https://a.com/deck.ppt") == "application/vnd.ms-powerpoint"
+    assert sniff_content_type("application/octet-stream", ole, "https://a.com/file") == "application/msword"
+
+
+def test_sniff_generic_and_wrong_types():
+    assert sniff_content_type("text/html", b"%PDF-1.7\n") == "application/pdf"
+    assert sniff_content_type("text/plain; charset=utf-8", b"hello") == "text/plain; charset=utf-8"
+    assert sniff_content_type("application/octet-stream", b"hello", "https://a.com/notes.csv") == "text/csv"
+    assert sniff_content_type("binary/octet-stream", b"hello") == "text/plain"
+    assert sniff_content_type(None, b"RIFF\x00\x00\x00\x00WEBPVP8 ") == "image/webp"
+    assert sniff_content_type(None, b"XXXX\x00\x00\x00\x00WEBPVP8 ") is None
+    assert sniff_content_type(None, b"\x00\x01\x02", "https://a.com/x.png") == "image/png"
+    assert sniff_content_type(None, b"") is None
+
+
+def test_sniff_html_prefixes():
+    assert sniff_content_type(None, b"\xef\xbb\xbf  \n<!DOCTYPE html><html>") == "text/html"
+    assert sniff_content_type("application/octet-stream", b"<HTML><body>hi") == "text/html"
+    assert sniff_content_type(None, b"\t<meta charset=utf-8>") == "text/html"
+    assert sniff_content_type(None, b"<xml>not html</xml>") == "text/plain"
+
+
+def test_sniff_truncated_utf8_is_text():
+    text = "caf\u00e9 \u2603".encode("utf-8")
+    assert sniff_content_type(None, text[:-1]) == "text/plain"
+    assert sniff_content_type(None, b"caf\xff\xfe more text after it") is None
+
+
+def test_llm_client_holds_the_token_limit():
+    client = LLMClient(StubBackend(), max_concurrency=1, tokens_per_minute=600_000)
+    # a bucket far smaller than each request, so oversized requests are what's tested
+    client.tokens = TokenBucket(10_000, 100)
+    params = {"max_tokens": 1500}
+    prompts = [f"page {i}" for i in range(4)]
+    charged = sum(client.estimate_tokens(prompt, "text-davinci-003", params) for prompt in prompts)
+
+    start = time.monotonic()
+    summaries = client.complete_many(prompts, "text-davinci-003", params)
+    elapsed = time.monotonic() - start
+
+    assert summaries == [f"Summary: page {i}" for i in range(4)]
+    assert client.backend.calls == 4
+    # every request but the last was paid for by the full bucket or refills
+    last = charged // len(prompts)
+    assert charged - last <= 100 + 10_000 * elapsed
+
+
+def slow_body(chunks, delay):
+    for _ in range(chunks):
+        time.sleep(delay)
+        yield b"x" * 1024
+
+
+def test_fetch_stops_a_download_when_the_budget_runs_out(tmp_path):
+    client = httpx.Client(transport=httpx.MockTransport(
+        lambda request: httpx.Response(200, content=slow_body(100, 0.05))
+    ))
+    cache = FetchCache(str(tmp_path), client=client)
+
+    budget = CrawlBudget(deadline=0.3)
+    start = time.monotonic()
+    with use_budget(budget), pytest.raises(BudgetExceeded):
+        cache.get("https://example.com/slow")
+    assert time.monotonic() - start < 1
+
+    budget = CrawlBudget(max_bytes=10 * 1024)
+    with use_budget(budget), pytest.raises(BudgetExceeded):
+        cache.get("https://example.com/large")
+    assert budget.bytes == 10 * 1024
+
+
+def test_fetch_cache_revalidates_stale_responses(tmp_path):
+    requests = []
+
+    def respond(request):
+        requests.append(request)
+        if request.headers.get("if-none-match") == '"v1"':
+            return httpx.Response(304)
+        return httpx.Response(200, headers={"etag": '"v1"'}, content=b"hello")
+
+    client = httpx.Client(transport=httpx.MockTransport(respond))
+    cache = FetchCache(str(tmp_path), client=client, ttl=0)
+    assert not cache.get("https://example.com/page").from_cache
+    response = cache.get("https://example.com/page")
+    assert len(requests) == 2
+    assert requests[1].headers["if-none-match"] == '"v1"'
+    assert response.from_cache
+    assert (response.status_code, response.content) == (200, b"hello")
+
+    # fresh responses don't touch the network
+    cache.ttl = 3600
+    assert cache.get("https://example.com/page").from_cache
+    assert len(requests) == 2
+
+
+def test_fetch_cache_evicts_the_least_recently_used(tmp_path):
+    requests = []
+
+    def respond(request):
+        requests.append(request.url.path)
+        return httpx.Response(200, content=request.url.path.encode() * 50)
+
+    client = httpx.Client(transport=httpx.MockTransport(respond))
+    cache = FetchCache(str(tmp_path), client=client, max_bytes=250)
+    cache.get("https://example.com/a")
+    cache.get("https://example.com/b")
+    assert cache.get("https://example.com/a").from_cache
+    # 300 bytes, over the limit: b goes, as a was used since
+    cache.get("https://example.com/c")
+    assert cache.get("https://example.com/a").from_cache
+    assert cache.get("https://example.com/c").from_cache
+    assert not cache.get("https://example.com/b").from_cache
+    assert requests == ["/a", "/b", "/c", "/b"]
+    assert len(list((tmp_path / "objects").glob("*/*"))) == 2
+
+
+def test_count_tokens_is_exact_for_non_ascii_text():
+    tiktoken = pytest.importorskip("tiktoken")
+    try:
+        encoding = tiktoken.encoding_for_model("text-davinci-003")
+    except Exception as e:
+        # the encoding is downloaded the first time it is used
+        pytest.skip(f"tiktoken encoding unavailable: {e}")
+    text = "東京は日本の首都です。Ünïcödé текст"
+    assert count_tokens(text, "text-davinci-003") == len(encoding.encode(text))
+    assert count_tokens(text, "text-davinci-003") > len(text) / CHARS_PER_TOKEN
+
+
+def test_finished_seeds_delete_their_checkpoint(tmp_path):
+    jobs = JobStore({})
+    jobs.create("job", ["https://a.com", "https://b.com"])
+    done, failed = tmp_path / "a.sqlite", tmp_path / "b.sqlite"
+    done.write_bytes(b"")
+    failed.write_bytes(b"")
+    jobs.finish_seed("job", 0, checkpoint_path=str(done))
+    jobs.finish_seed("job", 1, error="boom", checkpoint_path=str(failed))
+    assert not done.exists() and failed.exists()
+
+
+def test_unstarted_shards_get_a_grace_period():
+    store = {"run/heartbeats/2": time.time() - 1}
+    frontier = ShardFrontier(store, "run", 0, 3, dead_after=0.5, start_grace=60)
+    # shard 1 hasn't started yet, shard 2 stopped beating
+    assert frontier.dead_shards() == {2}
+    frontier.started_at -= 61
+    assert frontier.dead_shards() == {1, 2}
+
+
+def test_process_pool_recovers_from_a_dead_worker():
+    pool = ProcessPool(processes=1, metrics_interval=None)
+    try:
+        with pytest.raises(BrokenProcessPool):
+            pool.run(os._exit, 1)
+        assert pool.run(abs, -3) == 3
+        metrics = pool.metrics()
+        assert metrics["restarts"] == 1
+        assert metrics["failed"] == 1 and metrics["completed"] == 1
+    finally:
+        pool.close()
@@ -1,6 +1,11 @@
+import json
+import threading
+import time
 from fastapi import FastAPI
 from fastapi.testclient import TestClient
-from main import app, stub
+from crawler.distributed import ShardFrontier
+from main import BeatnikScraper, ScraperOptions, app, stub
+from plugins.manifest import PLUGINS, load_plugin_class
 
 client = TestClient(app)
 
@@ -33,6 +38,123 @@ def test_analyze_many():
     for url, result in response.json().items():
         print(url + ": " + str(result))
 
+def test_analyze_stream():
+    with client.stream("POST", "/analyze/stream", json={
+        "url": "https://news.ycombinator.com/",
+        "recursive_mode": "ConcurrentBFS",
+        "maintain_domain": True,
+        "max_urls": 5,
+        "save_to_azure": False,
+        "azure_container_name": "testing",
+    }) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/x-ndjson")
+        records = [json.loads(line) for line in response.iter_lines() if line]
+    assert 0 < len(records) <= 5
+    for record in records:
+        assert set(record) == {"url", "result"}
+
+def test_analyze_many_stream_sse():
+    with client.stream("POST", "/analyze-many/stream?format=sse", json={
+        "urls": ["https://news.ycombinator.com/", "https://dagster.io/blog/chatgpt-langchain"],
+        "recursive_mode": "BFS",
+        "maintain_domain": True,
+        "max_urls": 2,
+        "save_to_azure": False,
+        "azure_container_name": "testing",
+    }) as response:
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = [line for line in response.iter_lines() if line.startswith("event: ")]
+    assert 0 < len(events) <= 4
+
+def test_rate_options_must_be_positive():
+    for options in [{"per_host_rate": 0}, {"per_host_concurrency": 0}]:
+        response = client.post("/analyze", json={
+            "url": "https://news.ycombinator.com/",
+            "recursive_mode": "BFS",
+            "maintain_domain": True,
+            "max_urls": 5,
+            "save_to_azure": False,
+            "azure_container_name": "testing",
+            **options,
+        })
+        assert response.status_code == 422
+
+def test_crawl_job():
+    response = client.post("/jobs", json={
+        "urls": ["https://news.ycombinator.com/", "https://dagster.io/blog/chatgpt-langchain"],
+        "recursive_mode": "BFS",
+        "maintain_domain": True,
+        "max_urls": 2,
+        "save_to_azure": False,
+        "azure_container_name": "testing",
+    })
+    assert response.status_code == 200
+    job_id = response.json()["job_id"]
+
+    # read results while the job runs, as a client would
+    seen = []
+    cursor = None
+    deadline = time.time() + 600
+    while True:
+        status = client.get(f"/jobs/{job_id}").json()
+        params = {"page_size": 10} if cursor is None else {"page_size": 10, "cursor": cursor}
+        response = client.get(f"/jobs/{job_id}/results", params=params)
+        assert response.status_code == 200
+        seen.extend(result["url"] for result in response.json()["results"])
+        cursor = response.json()["cursor"]
+        if status["status"] == "completed" and not response.json()["results"]:
+            break
+        assert time.time() < deadline, "job did not complete in time"
+        time.sleep(5)
+    assert status["seeds"] == 2
+    assert len(seen) == status["pages_done"] + status["pages_failed"]
+
+class LinkPlugin:
+    """Pages link to four others, spread over 13 hosts."""
+
+    def get_links(self, url, fetched=None):
+        n = int(url.rsplit("/", 1)[1])
+        return [f"https://h{(n * 7 + i) % 13}.com/{n * 4 + i}" for i in range(4)]
+
+    def process(self, url, fetched=None):
+        return {"content": url}
+
+
+class LocalScraper(BeatnikScraper):
+    def get_proper_handler(self, url):
+        return LinkPlugin()
+
+
+def test_distributed_shards_in_process():
+    store = {}
+    results = {}
+    seeds = ["https://h0.com/0", "https://h1.com/1"]
+    options = ScraperOptions(respect_robots=False, per_host_rate=1000, per_host_concurrency=100)
+
+    def crawl_shard(shard, recursive_mode):
+        scraper = LocalScraper("./plugins", recursive_mode, False, 40, False, options=options, plugins=object())
+        frontier = ShardFrontier(store, recursive_mode, shard, 4, visited=scraper.new_visited_set(), poll_interval=0.05, flush_interval=0.05)
+        results[shard] = dict(scraper.iter_crawl_shard(seeds, frontier))
+
+    for recursive_mode in ["BFS", "ConcurrentBFS"]:
+        results.clear()
+        threads = [threading.Thread(target=crawl_shard, args=(shard, recursive_mode)) for shard in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(30)
+        assert not any(thread.is_alive() for thread in threads), "the run did not terminate"
+        pages = [url for shard_results in results.values() for url in shard_results]
+        assert len(pages) == len(set(pages))
+        # shards may each finish a page before they see the run is done
+        assert 40 <= len(pages) < 40 + 4
+
+def test_unknown_job():
+    response = client.get("/jobs/does-not-exist")
+    assert response.status_code == 404
+
 def test_upload():
     response = client.post("/test-upload", json={
         "container_name": "testing",
@@ -42,9 +164,15 @@ def test_upload():
     })
     assert response.status_code == 200
 
+def test_plugin_manifest():
+    # the manifest routes urls before plugins are imported, so it must agree with them
+    for module_name, manifest in PLUGINS.items():
+        plugin = load_plugin_class(module_name)()
+        assert manifest["domains"] == plugin.supported_domains
+
 if __name__ == "__main__":
     with stub.run():
         # test_root()
         # test_analyze()
         test_analyze_many()
-        # test_upload()
\ No newline at end of file
+        # test_upload()